@@ -4,8 +4,11 @@ import os.path
 import logging
 import subprocess
 
-from mfx.devices import LaserShutter
+from mfx.configuration import ConfigCache
+from mfx.devices import LaserShutter, ShutterGroup
+from mfx.elog import ElogQueue
 from mfx.db import daq, elog
+from ophyd.status import SubscriptionStatus, wait as status_wait
 from pcdsdevices.sequencer import EventSequencer, EventStep
 from pcdsdevices.evr import Trigger
 
@@ -13,7 +16,6 @@ from pcdsdevices.evr import Trigger
 # TODO  #
 #########
 # * elog
-# * time estimations
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +30,9 @@ opo_shutter = LaserShutter('MFX:USR:ao1:6', name='opo_shutter')
 evo_shutter1 = LaserShutter('MFX:USR:ao1:7', name='evo_shutter1')
 evo_shutter2 = LaserShutter('MFX:USR:ao1:2', name='evo_shutter1')
 evo_shutter3 = LaserShutter('MFX:USR:ao1:3', name='evo_shutter1')
+# Moved and read together
+shutters = ShutterGroup(evo_shutter1, evo_shutter2, evo_shutter3,
+                        opo_shutter, name='laser_shutters')
 
 # Sequencer object
 sequencer = EventSequencer('ECS:SYS0:7', name='mfx_sequencer')
@@ -47,6 +52,243 @@ inhibit = Trigger('MFX:LAS:EVR:01:TRIG6', name='inhibit_trigger')
 opo_time_zero = 748935
 base_inhibit_delay = 500000
 
+# Last configuration written to the sequencer steps and triggers
+config_cache = ConfigCache()
+# Settings of an unused sequencer step
+empty_step = {'eventcode': 0, 'delta_beam': 0, 'fiducial': 0, 'comment': ''}
+# Time to wait for configuration writes
+config_timeout = 10.
+
+# Sequencer steps of a single shot. Dark shots never send the inhibit event
+# codes and are read out on their own event code, so the DAQ data records
+# which shots had the laser. The readout steps are filled in from the
+# readout codes, see ``shot_steps``
+light_shot = [{'eventcode': 197, 'delta_beam': 2,
+               'fiducial': 0, 'comment': 'PulsePicker'},
+              {'eventcode': 212, 'delta_beam': 0,
+               'fiducial': 0, 'comment': 'Delay > 7 ms'},
+              {'eventcode': 211, 'delta_beam': 1,
+               'fiducial': 0, 'comment': 'Delay > 160 us'},
+              {'eventcode': 210, 'delta_beam': 1,
+               'fiducial': 0, 'comment': 'Delay < 160 us'},
+              {'eventcode': None, 'delta_beam': 0,
+               'fiducial': 0, 'comment': 'DAQ Readout'}]
+dark_shot = [{'eventcode': 197, 'delta_beam': 2,
+              'fiducial': 0, 'comment': 'PulsePicker'},
+             {'eventcode': None, 'delta_beam': 2,
+              'fiducial': 0, 'comment': 'DAQ Readout Dark'}]
+# Event codes the DAQ reads out light and dark shots on. Nothing here
+# configures or checks the DAQ, its readout must already trigger on both
+# codes or the shots on the missing one are silently not recorded
+shot_codes = {'L': 198, 'D': 199}
+
+
+def shot_steps(shot, codes=None):
+    """
+    Sequencer steps of a single light ``'L'`` or dark ``'D'`` shot
+
+    Parameters
+    ----------
+    shot: str
+        ``'L'`` or ``'D'``
+
+    codes: dict, optional
+        Readout event code of each kind of shot, ``shot_codes`` by default
+    """
+    codes = codes or shot_codes
+    if shot not in ('L', 'D'):
+        raise ValueError("Invalid shot %r, must be 'L' or 'D'" % shot)
+    steps = [dict(step) for step in (light_shot if shot == 'L'
+                                     else dark_shot)]
+    steps[-1]['eventcode'] = codes[shot]
+    return steps
+
+
+# Beam pulses per second
+beam_rate = 120.
+
+
+def sync_rate(rate):
+    """Sync marker rate in Hz of a string such as ``'10Hz'``"""
+    return float(str(rate).lower().rstrip('hz'))
+
+
+def pattern_pulses(pattern, rate):
+    """
+    Beam pulses taken by one pass of a shot pattern
+
+    The sequencer plays one pass of the pattern on every sync marker, so a
+    pass must fit within the beam pulses between two of them
+
+    Parameters
+    ----------
+    pattern: str
+        Shots of a single pass, e.g. ``'LD'``
+
+    rate: str
+        Sync marker rate, "10Hz" or "30Hz"
+
+    Returns
+    -------
+    pulses: int
+    """
+    pulses = sum(step['delta_beam'] for shot in pattern.upper()
+                 for step in shot_steps(shot))
+    period = beam_rate / sync_rate(rate)
+    if pulses > period:
+        raise ValueError("Pattern {!r} takes {} beam pulses, more than the "
+                         "{:g} between {} sync markers".format(pattern, pulses,
+                                                               period, rate))
+    return pulses
+
+
+# ELog posts are queued so the runs never wait on them
+elog_queue = ElogQueue(elog, spool=os.path.expanduser(
+                                    '~/.cache/mfx/ls1016_elog_spool.jsonl'))
+
+
+def inhibit_code(delay):
+    """
+    Inhibit event code and number of pulses prior for a laser delay
+
+    Parameters
+    ----------
+    delay: float
+        Requested laser delay in nanoseconds. Must be less that 15.5 ms
+
+    Returns
+    -------
+    inhibit_ec, ipulse: int
+    """
+    if delay <= 0.16e6:
+        logger.debug("Triggering on simultaneous event code")
+        return 210, 0
+    elif delay <= 7.e6:
+        logger.debug("Triggering on one event code prior")
+        return 211, 1
+    elif delay <= 15.5e6:
+        logger.debug("Triggering two event codes prior")
+        return 212, 2
+    else:
+        raise ValueError("Invalid input %s ns, must be < 15.5 ms" % delay)
+
+
+class ScanPlanner:
+    """
+    Order and time the runs of a delay scan
+
+    Parameters
+    ----------
+    delays: list
+        Requested laser delays in nanoseconds, ``False`` for no laser
+
+    nruns: int, optional
+        Number of iterations of the delays
+
+    light_events: int, optional
+        Events per light run
+
+    dark_events: int, optional
+        Events per dark run
+
+    rate: str, optional
+        "10Hz" or "30Hz"
+
+    pattern: str, optional
+        Shots of a single sequencer pass, see ``User.configure_sequencer``.
+        One pass is played on every sync marker, so ``len(pattern)`` events
+        are taken at ``rate``
+
+    run_overhead: float, optional
+        Dead time of a run in seconds, used until runs have been measured
+
+    delay_overhead: float, optional
+        Time in seconds to reprogram the triggers for a new delay
+    """
+    def __init__(self, delays, nruns=1, light_events=3000, dark_events=None,
+                 rate='10Hz', pattern='L', run_overhead=5.,
+                 delay_overhead=0.5):
+        pattern_pulses(pattern, rate)
+        self.delays = list(delays) or [False]
+        self.nruns = nruns
+        self.light_events = light_events
+        self.dark_events = dark_events
+        self.rate = sync_rate(rate)
+        self.pattern = pattern.upper()
+        self.run_overhead = run_overhead
+        self.delay_overhead = delay_overhead
+
+    @staticmethod
+    def _key(delay):
+        # Runs sharing an inhibit event code are kept together
+        if not delay:
+            return (0, 0)
+        return (inhibit_code(delay)[0], delay)
+
+    def schedule(self, reorder=True):
+        """
+        Ordered list of runs
+
+        With ``reorder`` the delays of each iteration are sorted by inhibit
+        event code and delay, and every other iteration is reversed, so that
+        consecutive runs reprogram the triggers as little as possible. Dark
+        runs have all shutters closed and never reprogram the triggers.
+
+        Returns
+        -------
+        steps: list of dict
+            ``iteration``, ``delay``, ``light``, ``events`` and
+            ``reconfigure``, whether the triggers need to be set first
+        """
+        order = list(self.delays)
+        if reorder:
+            order.sort(key=self._key)
+        steps = list()
+        current = None
+        for iteration in range(self.nruns):
+            delays = order
+            if reorder and iteration % 2:
+                delays = order[::-1]
+            for delay in delays:
+                if self.light_events:
+                    reconfigure = bool(delay) and delay != current
+                    if reconfigure:
+                        current = delay
+                    steps.append({'iteration': iteration, 'delay': delay,
+                                  'light': True,
+                                  'events': self.light_events,
+                                  'reconfigure': reconfigure})
+                if self.dark_events:
+                    steps.append({'iteration': iteration, 'delay': delay,
+                                  'light': False,
+                                  'events': self.dark_events,
+                                  'reconfigure': False})
+        return steps
+
+    def calibrate(self, run_metrics):
+        """Use the mean measured dead time of previous runs as overhead"""
+        if run_metrics:
+            self.run_overhead = (sum(m['dead_time'] for m in run_metrics)
+                                 / len(run_metrics))
+
+    def duration(self, step):
+        """Predicted wall time of a single step in seconds"""
+        shots = self.rate * len(self.pattern)
+        return (step['events'] / shots + self.run_overhead
+                + self.delay_overhead * step['reconfigure'])
+
+    def estimate(self, steps):
+        """Predicted wall time of a list of steps in seconds"""
+        return sum(self.duration(step) for step in steps)
+
+    def summary(self, reorder=True):
+        """Number of runs, trigger reconfigurations and predicted time"""
+        steps = self.schedule(reorder=reorder)
+        return {'runs': len(steps),
+                'reconfigurations': sum(s['reconfigure'] for s in steps),
+                'estimate': self.estimate(steps)}
+
+
 ###########################
 # Configuration Functions #
 ###########################
@@ -61,6 +303,10 @@ class User:
     inhibit = inhibit
     pacemaker = pacemaker
 
+    def __init__(self):
+        # Timing of every run taken by perform_run
+        self.run_metrics = list()
+
     @property
     def current_rate(self):
         """Current configured EventSequencer rate"""
@@ -81,11 +327,7 @@ class User:
     @property
     def shutter_status(self):
         """Show current shutter status"""
-        status = []
-        for shutter in (evo_shutter1, evo_shutter2,
-                        evo_shutter3, opo_shutter):
-            status.append(shutter.state.get())
-        return status
+        return shutters.state
 
     def configure_shutters(self, pulse1=False, pulse2=False, pulse3=False, opo=False):
         """
@@ -107,60 +349,97 @@ class User:
 
         opo: bool
             Controls ``opo_shutter``
+
+        Returns
+        -------
+        status: ophyd.status.StatusBase
+            Finished once all four shutters have moved
         """
-        for state, shutter in zip((pulse1, pulse2, pulse3, opo),
-                                  (evo_shutter1, evo_shutter2,
-                                   evo_shutter3, opo_shutter)):
+        states = (pulse1, pulse2, pulse3, opo)
+        for state, shutter in zip(states, shutters.shutters):
             logger.debug("Using %s : %s", shutter.name, state)
-            shutter.move(int(state) + 1)
+        return shutters.move([bool(state) for state in states])
 
-    def configure_sequencer(self, rate='10Hz'):
+    def configure_sequencer(self, rate='10Hz', pattern='L', codes=None,
+                            cached=False):
         """
         Setup laser triggers and EventSequencer
 
+        Every step is written at once. With ``cached`` only the fields that
+        differ from the last configuration are written, see
+        ``mfx.configuration.ConfigCache``
+
         Parameters
         ----------
         rate : str, optional
             "10Hz" or "30Hz"
+
+        pattern : str, optional
+            Shots of a single pass of the sequence, ``'L'`` for a light shot
+            and ``'D'`` for a dark shot. For example ``'LD'`` alternates
+            light and dark shots within a run. A pass of the pattern must fit
+            between two sync markers, see ``pattern_pulses``
+
+        codes : dict, optional
+            Readout event code of light and dark shots, ``shot_codes`` by
+            default. The DAQ readout must be configured for these codes,
+            this is not checked
+
+        cached : bool, optional
+            Skip the fields the cache says are already set. Only safe within
+            a scan, anything changed by hand since, e.g. from the EDM panel,
+            is not seen. By default every field is written
         """
         logger.info("Configure EventSequencer ...")
+        pattern_pulses(pattern, rate)
+        steps = list()
+        for shot in pattern.upper():
+            steps.extend(shot_steps(shot, codes=codes))
+        if len(steps) > len(seq_steps):
+            raise ValueError("Pattern {!r} needs {} sequencer steps, only {} "
+                             "are available".format(pattern, len(steps),
+                                                    len(seq_steps)))
         # Setup sequencer
         sequencer.sync_marker.put(rate)
-        sequencer.sequence_length.put(5)
-        # Set sequence
-        seq_steps[0].configure({'eventcode': 197, 'delta_beam': 2,
-                                'fiducial': 0, 'comment': 'PulsePicker'})
-        seq_steps[1].configure({'eventcode': 212, 'delta_beam': 0,
-                                'fiducial': 0, 'comment': 'Delay > 7 ms'})
-        seq_steps[2].configure({'eventcode': 211, 'delta_beam': 1,
-                                'fiducial': 0, 'comment': 'Delay > 160 us'})
-        seq_steps[3].configure({'eventcode': 210, 'delta_beam': 1,
-                                'fiducial': 0, 'comment': 'Delay < 160 us'})
-        seq_steps[4].configure({'eventcode': 198, 'delta_beam': 0,
-                                'fiducial': 0, 'comment': 'DAQ Readout'})
-        # Clear other sequence steps 
-        for i in range(5, 20):
-            seq_steps[i].clear()
-
-
-    def configure_evr(self):
+        sequencer.sequence_length.put(len(steps))
+        # Clear other sequence steps
+        steps.extend([empty_step] * (len(seq_steps) - len(steps)))
+        if not cached:
+            for step in seq_steps:
+                config_cache.invalidate(step)
+        status = config_cache.configure_many(zip(seq_steps, steps))
+        status_wait(status, timeout=config_timeout)
+
+
+    def configure_evr(self, cached=False):
         """
         Configure the Pacemaker and Inhibit EVR
 
         This handles setting the correct polarity and widths. However this
         **does not** handle configuring the delay between the two EVR triggers.
+
+        Parameters
+        ----------
+        cached : bool, optional
+            Skip the fields the cache says are already set. Only safe within
+            a scan, anything changed by hand since, e.g. from the EDM panel,
+            is not seen. By default every field is written
         """
         logger.debug("Configuring triggers to defaults ...")
-        # Pacemaker Trigger
-        pacemaker.configure({'eventcode': 40, 'polarity': 0,
-                             'width': 50000.})
+        if not cached:
+            config_cache.invalidate(pacemaker)
+            config_cache.invalidate(inhibit)
+        # Pacemaker and Inhibit Trigger
+        status = config_cache.configure_many(
+                    [(pacemaker, {'eventcode': 40, 'polarity': 0,
+                                  'width': 50000.}),
+                     (inhibit, {'polarity': 1, 'width': 2000000.})])
+        status_wait(status, timeout=config_timeout)
         pacemaker.enable()
-        # Inhibit Trigger
-        inhibit.configure({'polarity': 1, 'width': 2000000.})
         inhibit.enable()
 
 
-    def set_delay(self, delay):
+    def set_delay(self, delay, cached=False):
         """
         Set the relative delay between the pacemaker and inhibit triggers
 
@@ -168,38 +447,36 @@ class User:
         ----------
         delay: float
             Requested laser delay in nanoseconds. Must be less that 15.5 ms
+
+        cached : bool, optional
+            Skip the fields the cache says are already set. Only safe within
+            a scan, anything changed by hand since, e.g. from the EDM panel,
+            is not seen. By default every field is written
         """
+        if not cached:
+            config_cache.invalidate(pacemaker)
+            config_cache.invalidate(inhibit)
         # Determine event code of inhibit pulse
         logger.info("Setting delay %s ns (%s us)", delay, delay/1000.)
-        if delay <= 0.16e6:
-            logger.debug("Triggering on simultaneous event code")
-            inhibit_ec = 210
-            ipulse = 0
-        elif delay <= 7.e6:
-            logger.debug("Triggering on one event code prior")
-            inhibit_ec = 211
-            ipulse = 1
-        elif delay <= 15.5e6:
-            logger.debug("Triggering two event codes prior")
-            inhibit_ec = 212
-            ipulse = 2
-        else:
-            raise ValueError("Invalid input %s ns, must be < 15.5 ms")
+        inhibit_ec, ipulse = inhibit_code(delay)
         # Determine relative delays
         pulse_delay = ipulse*1.e9/120 - delay # Convert to ns
         # Configure Inhibit pulse
         inhibit_delay = opo_time_zero - base_inhibit_delay + pulse_delay
-        inhibit.configure({"eventcode": inhibit_ec, "ns_delay": inhibit_delay})
         # Conifgure Pacemaker pulse
         pacemaker_delay = opo_time_zero + pulse_delay
-        pacemaker.configure({"ns_delay": pacemaker_delay})
+        status = config_cache.configure_many(
+                    [(inhibit, {"eventcode": inhibit_ec,
+                                "ns_delay": inhibit_delay}),
+                     (pacemaker, {"ns_delay": pacemaker_delay})])
+        status_wait(status, timeout=config_timeout)
 
 
     ######################
     # Scanning Functions #
     ######################
     def perform_run(self, events, record=True, comment='', post=True,
-                    **kwargs):
+                    timeout=10., **kwargs):
         """
         Perform a single run of the experiment
 
@@ -217,6 +494,11 @@ class User:
         post: bool, optional
             Whether to post to the experimental ELog or not
 
+        timeout: float, optional
+            Time to wait for the shutters to settle, the DAQ to start
+            running and the sequencer to stop before giving up. Every wait
+            is on a status, nothing is polled
+
         kwargs:
             Used to control the laser shutters. See ``configure_shutters`` for more
             information
@@ -225,40 +507,66 @@ class User:
         ----
         This does not configure the laser parameters. Either use ``loop`` or
         ``configure_evr`` and ``configure_sequencer`` to set these parameters
+
+        The time spent in each phase of the run is logged and appended to
+        ``run_metrics``
         """
+        start = time.time()
         # Configure the shutters
-        self.configure_shutters(**kwargs)
-        # time.sleep(3) / a leftover from original script
-        # Post information to elog
-        if not daq.configured:  # Won't have runnumber without configuration
-            daq.configure()
-        runnum = daq.__control.runnumber()
+        shutter_status = self.configure_shutters(**kwargs)
+        # Configuring the DAQ is slow, only do it if recording changes. The
+        # number of events is given to the run itself. There is no run
+        # number without a configuration
+        if not daq.configured or daq.record != record:
+            daq.configure(record=record)
+        runnum = daq.runnumber()
+        # Shutters must be in place before any events are taken
+        status_wait(shutter_status, timeout=timeout)
+        # Post information to elog, reading the shutters now they have moved
         comment = comment or ''
-        info = (runnum, events, record, comment, self.delay)
-        info.extend(self.shutter_status)
-        post_msg = post_template.format(info)
-        print(post)
+        info = [runnum, events, record, comment, self.delay]
+        info.extend(shutter.state_from_voltage(shutter.voltage.get())
+                    for shutter in shutters.shutters)
+        post_msg = post_template.format(*info)
         if post:
-            elog.post(post_msg, runnum=runnum)
-        # Start recording
+            # Sent in the background, see mfx.elog
+            elog_queue.post(post_msg, runnum=runnum)
+        # Start recording, the DAQ must be running before sending events
         logger.info("Starting DAQ run, -> record=%s", record)
-        daq.begin(events=events, record=record)
-        time.sleep(2)  # Wait for the DAQ to get spinnign before sending events
+        status_wait(daq.kickoff(events=events), timeout=timeout)
         logger.debug("Starting EventSequencer ...")
         sequencer.start()
-        # Wait for the DAQ to finish
+        acquire = time.time()
+        # Finished by the DAQ once every event has been taken
         logger.info("Waiting or DAQ to complete %s events ...", events)
-        daq.wait()
+        status_wait(daq.complete())
         logger.info("Run complete!")
-        daq.end_run()
+        teardown = time.time()
         logger.debug("Stopping Sequencer ...")
+        stopped = SubscriptionStatus(
+                    sequencer.play_status,
+                    lambda *args, value=None, **kwargs: value == 0,
+                    timeout=timeout)
         sequencer.stop()
-        # time.sleep(3) / a leftover from original script
+        daq.end_run()
+        status_wait(stopped, timeout=timeout)
+        # Record where the time went
+        end = time.time()
+        metrics = {'run': runnum, 'events': events,
+                   'setup': acquire - start,
+                   'acquire': teardown - acquire,
+                   'teardown': end - teardown,
+                   'dead_time': (acquire - start) + (end - teardown),
+                   'total': end - start}
+        self.run_metrics.append(metrics)
+        logger.info("Run %s took %.1f s, %.1f s of which was dead time",
+                    runnum, metrics['total'], metrics['dead_time'])
+        return metrics
 
 
     def loop(self, delays=[], nruns=1, pulse1=False, pulse2=False,
              pulse3=False, light_events=3000, dark_events=None, rate='10Hz',
-             **kwargs):
+             reorder=False, interleave=None, readout_codes=None, **kwargs):
         """
         Loop through a number of delays a number of times while running the DAQ
 
@@ -288,41 +596,93 @@ class User:
         rate : str, optional
             "10Hz" or "30Hz"
 
+        reorder: bool, optional
+            Reorder the delays to reprogram the triggers as little as
+            possible. See ``ScanPlanner.schedule``
+
+        interleave: str, optional
+            Take light and dark shots within the same run using this shot
+            pattern, e.g. ``'LD'``. See ``configure_sequencer``. Each run
+            then holds ``light_events`` light shots and the dark shots in
+            between them, and ``dark_events`` is ignored
+
+        readout_codes: dict, optional
+            Readout event codes of light and dark shots, ``{'L': 198,
+            'D': 199}`` by default. The DAQ must already read out on both,
+            otherwise the shots on the other code are missing from the data
+
         kwargs:
             Remainder of the kwargs are passed to ``perform_run`` to setup the DAQ
             and ELog. This includes ``record``, ``comment``, and ``post``
         """
         # Stop the EventSequencer
         sequencer.stop()
-        self.configure_sequencer(rate=rate)
+        codes = readout_codes or shot_codes
+        if interleave:
+            interleave = interleave.upper()
+            nlight = interleave.count('L')
+            if not nlight:
+                raise ValueError("Interleaved pattern needs a light shot")
+            # Dark shots come within the light runs
+            light_events = light_events * len(interleave) // nlight
+            dark_events = None
+            kwargs['comment'] = ('{} Interleaved shot pattern {}, light shots '
+                                 'read out on {L} and dark shots on {D}'
+                                 ''.format(kwargs.get('comment', ''),
+                                           interleave, **codes)).strip()
+            logger.warning("Dark shots are read out on event code %s, make "
+                           "sure the DAQ readout includes it", codes['D'])
+        # Anything may have been changed by hand since the last scan
+        config_cache.invalidate()
+        self.configure_sequencer(rate=rate, pattern=interleave or 'L',
+                                 codes=codes)
         self.configure_evr()
         # Preserve the original state of DAQ
         logger.info("Running delays %r, %s times ...", delays, nruns)
-        delays = delays or [False]
+        planner = ScanPlanner(delays, nruns=nruns, light_events=light_events,
+                              dark_events=dark_events, rate=rate,
+                              pattern=interleave or 'L')
+        planner.calibrate(self.run_metrics)
+        steps = planner.schedule(reorder=reorder)
         # Estimated time for completion
+        logger.info("Scan of %s runs estimated to take %.1f min",
+                    len(steps), planner.estimate(steps) / 60.)
         try:
-            for run in range(nruns):
-                logger.info("Beginning run %s of %s", run, nruns)
-                for delay in delays:
-                    if light_events:
-                        logger.info("Beginning light events using delay %s", delay)
-                        # Set the laser delay if it exists
-                        if delay:
-                            self.set_delay(delay)
-                        # Perform the light run
-                        self.perform_run(light_events, pulse1=pulse1,
-                                         pulse2=pulse2, pulse3=pulse3,
-                                         opo=bool(delay), **kwargs)
-                    # Estimated time for completion
+            for i, step in enumerate(steps):
+                if not i or step['iteration'] != steps[i-1]['iteration']:
+                    logger.info("Beginning run %s of %s",
+                                step['iteration'], nruns)
+                delay = step['delay']
+                if step['light']:
+                    logger.info("Beginning light events using delay %s", delay)
+                    # Set the laser delay if it has changed
+                    if step['reconfigure']:
+                        # Triggers were written in full by configure_evr
+                        self.set_delay(delay, cached=True)
+                    # Perform the light run
+                    metrics = self.perform_run(step['events'], pulse1=pulse1,
+                                               pulse2=pulse2, pulse3=pulse3,
+                                               opo=bool(delay), **kwargs)
+                    if interleave:
+                        metrics['pattern'] = interleave
+                        metrics['readout_codes'] = dict(codes)
+                else:
                     # Perform the dark run
                     # No shutter information means all closed!
-                    if dark_events:
-                        self.perform_run(events=dark_events, **kwargs)
+                    self.perform_run(events=step['events'], **kwargs)
+                # Estimated time for completion
+                planner.calibrate(self.run_metrics)
+                logger.info("%s of %s runs complete, %.1f min remaining",
+                            i + 1, len(steps),
+                            planner.estimate(steps[i+1:]) / 60.)
             logger.info("All requested scans completed!")
         except KeyboardInterrupt:
             logger.warning("Scan interrupted by user request!")
         # Return the DAQ to the original state
         finally:
+            if elog_queue.pending:
+                logger.info("%s ELog posts still queued, they will be sent "
+                            "in the background", elog_queue.pending)
             logger.info("Disconnecting from DAQ ...")
             daq.disconnect()
             logger.info("Closing all laser shutters ...")
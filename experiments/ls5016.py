@@ -1,6 +1,13 @@
+import time
+
+import numpy as np
+
 from bluesky.plans import outer_product_scan
-from bluesky.plan_stubs import one_nd_step
-from ophyd import Device, EpicsSignal, EpicsSignalRO, Component as C
+from bluesky.plan_stubs import (one_nd_step, abs_set, mv, sleep, wait,
+                                trigger_and_read)
+from bluesky.preprocessors import run_decorator, finalize_wrapper
+from ophyd import (Device, EpicsSignal, EpicsSignalRO, Signal,
+                   Component as C)
 from ophyd.status import SubscriptionStatus, wait as status_wait
 
 from mfx.db import inj_x, inj_y
@@ -9,6 +16,10 @@ from mfx.db import inj_x, inj_y
 class EventSequencer(Device):
     """
     Simple Event Sequencer
+
+    Starting and stopping return statuses driven by the monitored
+    ``play_status``, nothing is polled. ``play_count``, ``start_latency``
+    and ``play_duration`` describe the most recent plays.
     """
     play_control = C(EpicsSignal, ':PLYCTL')
     play_status = C(EpicsSignalRO, ':PLSTAT', auto_monitor=True)
@@ -16,26 +27,73 @@ class EventSequencer(Device):
     _default_read_attrs = ['play_status']
     _default_configuration_attrs = ['play_control']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.play_count = 0
+        self.start_latency = None
+        self.play_duration = None
+
+    @property
+    def metrics(self):
+        """Play count and timing of the last play in seconds"""
+        return {'play_count': self.play_count,
+                'start_latency': self.start_latency,
+                'play_duration': self.play_duration}
+
     def set(self, *args, wait=False, timeout=None):
-        # Start the sequencer
-        self.play_control.set(1)
-        # Wait for the sequencer to start before subscribing
-        while self.play_status.value == 0:
-            time.sleep(0.001)
-        # Create our status
-        def done(*args, value=None, old_value=None,  **kwargs):
-            return value == 0 and old_value == 2
-        status = SubscriptionStatus(self.play_status, done)
+        """
+        Start the sequencer
+
+        Returns
+        -------
+        status : SubscriptionStatus
+            Finished once the sequencer has started and then stopped again,
+            or failed after ``timeout`` seconds
+        """
+        start = time.monotonic()
+        started = dict()
 
+        # Create our status before starting so no transition is missed
+        def done(*args, value=None, **kwargs):
+            now = time.monotonic()
+            if value != 0 and not started:
+                started['time'] = now
+                self.start_latency = now - start
+            elif value == 0 and started:
+                self.play_count += 1
+                self.play_duration = now - started['time']
+                return True
+            return False
+
+        status = SubscriptionStatus(self.play_status, done, timeout=timeout,
+                                    run=False)
+        # Start the sequencer
+        self.play_control.put(1)
         # Wait on the sequencer
         if wait:
             status_wait(status, timeout=timeout)
         return status
 
-    def stop(self, wait=False):
+    def stop(self, wait=False, timeout=None, success=False):
+        """
+        Stop the sequencer
+
+        Returns
+        -------
+        status : SubscriptionStatus
+            Finished once ``play_status`` reports the sequencer has stopped
+        """
+        def done(*args, value=None, **kwargs):
+            return value == 0
+
+        status = SubscriptionStatus(self.play_status, done, timeout=timeout)
         self.play_control.put(0)
-        while play_status.value != 0:
-            time.sleep(0.001)
+        if wait:
+            status_wait(status, timeout=timeout)
+        return status
+
+
+seq = EventSequencer('ECS:SYS0:7', name='seq')
 
 
 def grid_scan(x_start, x_finish, x_steps,
@@ -78,3 +136,156 @@ def grid_scan(x_start, x_finish, x_steps,
                                       per_step=run_sequencer)
     # Return plan to user
     yield from inner()
+
+
+def velocity_limits(motor):
+    """
+    Slowest and fastest velocity of a motor, None where unknown
+
+    Taken from the base and maximum velocity of the motor record if the
+    motor has them, and otherwise from the limits of its velocity signal
+    """
+    low = high = None
+    base = getattr(motor, 'velocity_base', None)
+    if base is not None:
+        low = base.get()
+    maximum = getattr(motor, 'velocity_max', None)
+    if maximum is not None:
+        # A maximum of zero means there is none
+        high = maximum.get() or None
+    velocity = getattr(motor, 'velocity', None)
+    if velocity is not None and (low is None or high is None):
+        lower, upper = velocity.limits
+        if lower != upper:
+            low = lower if low is None else low
+            high = upper if high is None else high
+    return low, high
+
+
+def grid_fly_scan(x_start, x_finish, x_steps,
+                  y_start, y_finish, y_steps,
+                  shot_rate=10., snake=True, sequencer=None):
+    """
+    Fly the injector along X while firing the sequencer at a fixed rate
+
+    Each row moves ``inj_x`` continuously from one edge of the grid to the
+    other at the speed that spaces ``x_steps`` shots evenly across it, and
+    the sequencer is played every ``1 / shot_rate`` seconds. The readback of
+    ``inj_x`` is recorded during the row, and once the row is done an event
+    is emitted per shot with the X position interpolated at the time of the
+    shot. Rows are stepped in Y, snaking by default. Rows must have a
+    length, and the speed must be within the ``velocity_limits`` of
+    ``inj_x``, otherwise a ``ValueError`` is raised before anything moves.
+
+    Parameters
+    ----------
+    x_start : float
+        First point in X scan
+
+    x_finish: float
+        Last point in X scan
+
+    x_steps : int
+        Number of shots per row
+
+    y_start: float
+        First row in Y scan
+
+    y_finish: float
+        Last row in Y scan
+
+    y_steps: int
+        Number of rows
+
+    shot_rate: float, optional
+        Shots per second. A single play of the sequencer must fit within
+        one shot period
+
+    snake: bool, optional
+        Snake scan instead of typewriter
+
+    sequencer: EventSequencer, optional
+        Defaults to ``seq``
+    """
+    sequencer = sequencer or seq
+    if x_start == x_finish:
+        raise ValueError("Rows of a fly scan can not have zero length, use "
+                         "grid_scan to shoot a single column")
+    period = 1. / shot_rate
+    row_time = max(x_steps - 1, 1) * period
+    speed = abs(x_finish - x_start) / row_time
+    low, high = velocity_limits(inj_x)
+    if (low is not None and speed < low) or (high is not None
+                                             and speed > high):
+        raise ValueError("Flying {} shots over {} at {} Hz needs a speed of "
+                         "{:.4g}, outside the velocity limits {} to {} of {}"
+                         "".format(x_steps, abs(x_finish - x_start),
+                                   shot_rate, speed, low, high, inj_x.name))
+    ys = np.linspace(y_start, y_finish, y_steps)
+    # Per shot readings
+    shot_x = Signal(name='inj_x_interp', value=x_start)
+    shot_y = Signal(name='inj_y_row', value=y_start)
+    shot_row = Signal(name='row', value=0)
+    velocity = getattr(inj_x, 'velocity', None)
+    original_velocity = velocity.get() if velocity is not None else None
+    md = {'plan_name': 'grid_fly_scan',
+          'plan_args': {'x_start': x_start, 'x_finish': x_finish,
+                        'x_steps': x_steps, 'y_start': y_start,
+                        'y_finish': y_finish, 'y_steps': y_steps,
+                        'shot_rate': shot_rate, 'snake': snake},
+          'motors': [inj_x.name, inj_y.name]}
+
+    def fly_row(row, y):
+        forward = not snake or row % 2 == 0
+        first, last = (x_start, x_finish) if forward else (x_finish, x_start)
+        # Move to the start of the row at full speed
+        if velocity is not None:
+            yield from mv(velocity, original_velocity)
+        yield from mv(inj_x, first, inj_y, y)
+        if velocity is not None:
+            yield from mv(velocity, speed)
+        # Record the motion while we fly
+        samples = list()
+
+        # Stamped on arrival with the same clock as the shots, the IOC
+        # timestamp may be offset from the workstation
+        def record(*args, value=None, **kwargs):
+            samples.append((time.time(), value))
+
+        cid = inj_x.subscribe(record, run=False)
+        shots = list()
+        try:
+            start = time.time()
+            samples.append((start, first))
+            yield from abs_set(inj_x, last, group='fly_row')
+            for i in range(x_steps):
+                # Keep the shots on the time grid of the motion
+                remaining = start + i * period - time.time()
+                if remaining > 0:
+                    yield from sleep(remaining)
+                shots.append(time.time())
+                yield from abs_set(sequencer, 0, wait=True)
+            yield from wait(group='fly_row')
+            samples.append((time.time(), inj_x.position))
+        finally:
+            inj_x.unsubscribe(cid)
+        # Tag each shot with where the injector was
+        times, positions = zip(*sorted(samples))
+        for shot in shots:
+            shot_x.put(float(np.interp(shot, times, positions)),
+                       timestamp=shot)
+            shot_y.put(y, timestamp=shot)
+            shot_row.put(row, timestamp=shot)
+            yield from trigger_and_read([shot_x, shot_y, shot_row])
+
+    @run_decorator(md=md)
+    def inner():
+        for row, y in enumerate(ys):
+            yield from fly_row(row, y)
+
+    def restore():
+        if velocity is not None:
+            yield from mv(velocity, original_velocity)
+
+    # Return plan to user
+    yield from finalize_wrapper(inner(), restore())
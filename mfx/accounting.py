@@ -0,0 +1,170 @@
+"""
+Bookkeeping of the beamtime lost to suspenders
+"""
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SuspensionLog:
+    """
+    Record of every suspend and resume of one or more suspenders
+
+    Records are kept in memory in a ring of fixed length and, if a path is
+    given, appended to a file with one JSON record per line.
+
+    Parameters
+    ----------
+    maxlen : int, optional
+        Number of records kept in memory
+
+    path : str, optional
+        File to append each completed record to
+    """
+    def __init__(self, maxlen=1000, path=None):
+        self.records = deque(maxlen=maxlen)
+        self.path = path
+        self.started = time.time()
+        self._active = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, maxlen=1000):
+        """Rebuild a log from a file written by a previous session"""
+        log = cls(maxlen=maxlen)
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    log.records.append(json.loads(line))
+        if log.records:
+            log.started = log.records[0]['suspended']
+        log.path = path
+        return log
+
+    def suspend(self, suspender, value, justification=''):
+        """Note that ``suspender`` tripped with ``value``"""
+        with self._lock:
+            if suspender in self._active:
+                return
+            self._active[suspender] = {'suspender': suspender,
+                                       'suspended': time.time(),
+                                       'trip_value': value,
+                                       'min_value': value,
+                                       'justification': justification}
+        logger.info("%s suspended at %s", suspender, value)
+
+    def update(self, suspender, value):
+        """Track the worst value seen while ``suspender`` is tripped"""
+        with self._lock:
+            record = self._active.get(suspender)
+            if record is not None and value is not None:
+                if record['min_value'] is None:
+                    record['min_value'] = value
+                else:
+                    record['min_value'] = min(record['min_value'], value)
+
+    def resume(self, suspender, value, sleep=0.):
+        """Note that ``suspender`` cleared, ``sleep`` is the resume delay"""
+        with self._lock:
+            record = self._active.pop(suspender, None)
+            if record is None:
+                return
+            record['resumed'] = time.time()
+            record['resume_value'] = value
+            record['duration'] = record['resumed'] - record['suspended']
+            record['dead_time'] = record['duration'] + sleep
+            self.records.append(record)
+        logger.info("%s resumed after %.1f s", suspender, record['duration'])
+        if self.path:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record, default=float) + '\n')
+            except OSError:
+                logger.exception("Unable to persist suspension record")
+        return record
+
+    def histogram(self, bins=10, key='trip_value'):
+        """
+        Histogram of the values at which the suspenders tripped
+
+        Returns
+        -------
+        counts, edges : np.ndarray
+        """
+        values = [r[key] for r in self.records if r.get(key) is not None]
+        return np.histogram(np.asarray(values, dtype=float), bins=bins)
+
+    def summary(self, bins=10):
+        """
+        Summary of the beamtime lost to suspensions
+
+        Returns
+        -------
+        summary : dict
+            ``count``, ``dead_time``, ``elapsed`` and ``fraction`` of time
+            suspended, ``per_hour`` suspend frequency, ``mean_duration`` and
+            ``histogram`` of trip values as ``(counts, edges)``
+        """
+        records = list(self.records)
+        elapsed = time.time() - self.started
+        dead_time = sum(r['dead_time'] for r in records)
+        summary = {'count': len(records),
+                   'dead_time': dead_time,
+                   'elapsed': elapsed,
+                   'fraction': dead_time / elapsed if elapsed else 0.,
+                   'per_hour': len(records) * 3600. / elapsed
+                               if elapsed else 0.,
+                   'mean_duration': dead_time / len(records)
+                                    if records else 0.,
+                   'active': list(self._active)}
+        if records:
+            summary['histogram'] = self.histogram(bins=bins)
+        return summary
+
+    def report(self, bins=10):
+        """Print a human readable summary"""
+        summary = self.summary(bins=bins)
+        print('Suspended {count} times ({per_hour:.2f}/hour), '
+              '{dead_time:.1f} s of {elapsed:.1f} s lost ({fraction:.1%})'
+              ''.format(**summary))
+        if 'histogram' in summary:
+            for count, low, high in zip(summary['histogram'][0],
+                                        summary['histogram'][1][:-1],
+                                        summary['histogram'][1][1:]):
+                print('{:>10.4g} - {:<10.4g} {}'.format(low, high,
+                                                        '#' * int(count)))
+
+
+class SuspensionAccountingMixin:
+    """
+    Record every suspend and resume of a suspender in a ``SuspensionLog``
+
+    Pass ``suspension_log`` to share a log between suspenders, otherwise each
+    suspender creates its own.
+    """
+    def __init__(self, *args, suspension_log=None, **kwargs):
+        self.suspension_log = suspension_log or SuspensionLog()
+        super().__init__(*args, **kwargs)
+
+    def _trip_value(self, value):
+        """Value recorded for the trip, the signal value by default"""
+        return value
+
+    def __call__(self, value, **kwargs):
+        was_tripped = self.tripped
+        super().__call__(value, **kwargs)
+        name = getattr(self._sig, 'name', None) or self.__class__.__name__
+        recorded = self._trip_value(value)
+        if self.tripped and not was_tripped:
+            self.suspension_log.suspend(name, recorded,
+                                        self._get_justification())
+        elif self.tripped:
+            self.suspension_log.update(name, recorded)
+        elif was_tripped:
+            self.suspension_log.resume(name, recorded, sleep=self._sleep)
@@ -0,0 +1,185 @@
+"""
+Shared rolling average service for many beam diagnostics
+
+Rather than each ``AvgSignal`` carrying its own lock, buffer and callback
+work, every window lives in a row of a single preallocated array. Monitor
+callbacks only append to an ingestion queue, and one worker thread folds the
+samples into the windows and publishes the averages.
+"""
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from ophyd.signal import Signal
+
+logger = logging.getLogger(__name__)
+
+
+class AverageView(Signal):
+    """
+    Read-only view of a single rolling average held by an
+    ``AveragingService``
+    """
+    def __init__(self, service, row, source, name=None, parent=None,
+                 **kwargs):
+        super().__init__(name=name, parent=parent, **kwargs)
+        self.service = service
+        self.row = row
+        self.source = source
+
+    @property
+    def averages(self):
+        """Number of samples in the window"""
+        return int(self.service.windows[self.row])
+
+    @property
+    def values(self):
+        """Samples currently in the window"""
+        return self.service.buffer[self.row, :self.averages]
+
+    def _publish(self, value):
+        super().put(value)
+
+    def put(self, value, **kwargs):
+        raise PermissionError("{} is a read-only average".format(self.name))
+
+
+class AveragingService:
+    """
+    Rolling averages of many signals sharing a single buffer and thread
+
+    Parameters
+    ----------
+    capacity : int, optional
+        Maximum number of signals that can be averaged
+
+    max_window : int, optional
+        Longest window any signal may request
+
+    Example
+    -------
+    .. code::
+
+        service = AveragingService()
+        gdet = service.add(EpicsSignalRO('GDET:FEE1:241:ENRC'), 120)
+    """
+    def __init__(self, capacity=16, max_window=1200):
+        self.capacity = capacity
+        self.max_window = max_window
+        self.buffer = np.zeros((capacity, max_window))
+        self.windows = np.ones(capacity, dtype=int)
+        self.indices = np.zeros(capacity, dtype=int)
+        self.sums = np.zeros(capacity)
+        self.views = list()
+        # Appends and pops on a deque are atomic, so monitor callbacks never
+        # contend with the worker for a lock
+        self._queue = deque()
+        self._wake = threading.Event()
+        self._add_lock = threading.Lock()
+        self._process_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def add(self, signal, averages, name=None):
+        """
+        Start averaging a signal
+
+        Parameters
+        ----------
+        signal : ophyd.Signal
+            Signal to average
+
+        averages : int
+            Number of samples in the window
+
+        name : str, optional
+            Name of the returned view. Defaults to ``<signal.name>_avg``
+
+        Returns
+        -------
+        view : AverageView
+            Signal that holds the current average
+        """
+        if not 1 <= averages <= self.max_window:
+            raise ValueError("Window must be between 1 and {} samples"
+                             "".format(self.max_window))
+        with self._add_lock:
+            row = len(self.views)
+            if row >= self.capacity:
+                raise RuntimeError("AveragingService is full with {} signals"
+                                   "".format(self.capacity))
+            initial = signal.get()
+            self.buffer[row, :averages] = initial
+            self.windows[row] = averages
+            self.indices[row] = 0
+            self.sums[row] = initial * averages
+            view = AverageView(self, row, signal,
+                               name=name or signal.name + '_avg',
+                               value=initial)
+            self.views.append(view)
+
+        def ingest(*args, value, **kwargs):
+            self._queue.append((row, value))
+            self._wake.set()
+
+        signal.subscribe(ingest, run=False)
+        self.start()
+        return view
+
+    def start(self):
+        """Start the worker thread if it is not already running"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='mfx-averaging')
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread"""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.process()
+            except Exception:
+                logger.exception("Failed to update rolling averages")
+
+    def process(self):
+        """
+        Fold every queued sample into its window and publish the averages
+
+        This is called by the worker thread, but can be called directly to
+        drain the queue synchronously. The buffers are only changed and the
+        averages only published with the lock held, so both can run at once
+        and an older average never replaces a newer one.
+        """
+        touched = set()
+        with self._process_lock:
+            while True:
+                try:
+                    row, value = self._queue.popleft()
+                except IndexError:
+                    break
+                index = self.indices[row]
+                self.sums[row] += value - self.buffer[row, index]
+                self.buffer[row, index] = value
+                index += 1
+                if index == self.windows[row]:
+                    index = 0
+                    # Resynchronize once per pass to drop accumulated error
+                    self.sums[row] = self.buffer[row, :self.windows[row]].sum()
+                self.indices[row] = index
+                touched.add(row)
+            # Publish each average once, however many samples arrived
+            for row in sorted(touched):
+                self.views[row]._publish(self.sums[row] / self.windows[row])
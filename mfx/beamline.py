@@ -1,20 +1,29 @@
 import logging
 
-from .devices import XFLS
-
-from hutch_python.utils import safe_load
-from mfx.suspenders import BeamEnergySuspendFloor
+from mfx.lazy import LazyDevice, warm
 
 logger = logging.getLogger(__name__)
 
 
-
-with safe_load('transfocator'):
+# Devices are built on first use, see mfx.lazy
+def _transfocator():
     from transfocate import Transfocator
-    tfs = Transfocator("MFX:LENS", name='MFX Transfocator')
+    return Transfocator("MFX:LENS", name='MFX Transfocator')
+
+
+def _mfx_prefocus():
+    from .devices import XFLS
+    return XFLS('MFX:DIA:XFLS', name='mfx_prefocus')
+
+
+def _beam_suspender():
+    from mfx.suspenders import BeamEnergySuspendFloor
+    return BeamEnergySuspendFloor(0.6)
+
 
-with safe_load('mfx_prefocus'):
-    mfx_prefocus = XFLS('MFX:DIA:XFLS', name='mfx_prefocus')
+tfs = LazyDevice('transfocator', _transfocator)
+mfx_prefocus = LazyDevice('mfx_prefocus', _mfx_prefocus)
+beam_suspender = LazyDevice('beam_suspender', _beam_suspender)
 
-with safe_load('beam_suspender'):
-    beam_suspender = BeamEnergySuspendFloor(0.6)
+# Connect in the background so the session starts without waiting on CA
+_warm_thread = warm(tfs, mfx_prefocus, beam_suspender)
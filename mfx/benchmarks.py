@@ -0,0 +1,259 @@
+"""
+Offline benchmarks of the MFX plans and signals
+
+Everything runs against ``mfx.sim``, so no PVs are needed. Each benchmark
+returns a dictionary of timings so that results can be saved and compared
+between versions to catch regressions before a beamtime.
+
+Example
+-------
+.. code::
+
+    python -m mfx.benchmarks
+    python -m mfx.benchmarks --json results.json averaging tfs_scan
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+
+from ophyd.signal import Signal
+
+from . import sim
+from .stats import RollingStats
+
+logger = logging.getLogger(__name__)
+
+
+def _run_engine():
+    from bluesky import RunEngine
+    # No signal handlers, the benchmarks may not run in the main thread
+    return RunEngine({}, context_managers=[])
+
+
+def _import_experiment(name, control):
+    """Import an experiment file against the simulated control system"""
+    sim.install(control)
+    return importlib.import_module('experiments.{}'.format(name))
+
+
+def bench_averaging(updates=20000, averages=120, capacity=16):
+    """
+    Callback throughput of ``AvgSignal`` for each reducer and of the shared
+    ``AveragingService``
+
+    Returns
+    -------
+    results : dict
+        Updates per second keyed by reducer, and ``service`` for the
+        service including the time to drain its queue
+    """
+    from .suspenders import AvgSignal
+    from .averaging import AveragingService
+    results = dict()
+    for reducer in RollingStats.reducers:
+        source = Signal(name='gdet', value=1.)
+        avg = AvgSignal(source, averages, reducer=reducer, name='gdet_avg')
+        start = time.perf_counter()
+        for i in range(updates):
+            source.put(float(i % 100))
+        results[reducer] = updates / (time.perf_counter() - start)
+        # Report the published average so that it is actually computed
+        avg.get()
+    service = AveragingService(capacity=capacity)
+    sources = [Signal(name='sig_{}'.format(i), value=1.)
+               for i in range(capacity)]
+    for source in sources:
+        service.add(source, averages)
+    per_signal = updates // capacity
+    start = time.perf_counter()
+    for i in range(per_signal):
+        for source in sources:
+            source.put(float(i % 100))
+    service.process()
+    results['service'] = per_signal * capacity / (time.perf_counter() - start)
+    return results
+
+
+def bench_tfs_scan(control=None, distance=1., repeats=3):
+    """
+    Wall time of ``mfx.plans.tfs_scan`` over simulated motion
+
+    Only runs against ``mfx.sim``. ``mfx.plans`` imports ``tfs_trans`` from
+    ``mfx.beamline``, which does not define it, so the plan does not import
+    in a live session
+
+    Returns
+    -------
+    results : dict
+        ``wall`` time of each scan, ``motion`` time spent moving and the
+        ``overhead`` of the plan and RunEngine beyond that
+    """
+    control = control or sim.SimControlSystem()
+    sim.install(control)
+    from .plans import tfs_scan
+    RE = _run_engine()
+    motor = control.tfs_trans
+    motion = 2 * distance / motor.velocity.get()
+    walls = list()
+    for _ in range(repeats):
+        motor.set(0.).wait()
+        start = time.perf_counter()
+        RE(tfs_scan(distance, 0.))
+        walls.append(time.perf_counter() - start)
+    wall = min(walls)
+    return {'wall': wall, 'motion': motion, 'overhead': wall - motion}
+
+
+def bench_grid_scans(control=None, x_steps=5, y_steps=3, shot_rate=10.):
+    """
+    Wall time of ``ls5016.grid_scan`` against ``ls5016.grid_fly_scan`` over
+    the same grid
+
+    Returns
+    -------
+    results : dict
+        Wall time and shots per second of each scan
+    """
+    control = control or sim.SimControlSystem()
+    ls5016 = _import_experiment('ls5016', control)
+    sim.patch_ls5016(ls5016, control)
+    RE = _run_engine()
+    results = dict()
+    scans = {'grid_scan': lambda: ls5016.grid_scan(0., 1., x_steps,
+                                                   0., 1., y_steps),
+             'grid_fly_scan': lambda: ls5016.grid_fly_scan(
+                                        0., 1., x_steps, 0., 1., y_steps,
+                                        shot_rate=shot_rate)}
+    for name, plan in scans.items():
+        control.inj_x.set(0.).wait()
+        control.inj_y.set(0.).wait()
+        start = time.perf_counter()
+        RE(plan())
+        wall = time.perf_counter() - start
+        results[name] = {'wall': wall,
+                         'shots_per_second': x_steps * y_steps / wall}
+    return results
+
+
+def bench_ls1016_loop(control=None, delays=(1e5, 2e5), nruns=1,
+                      light_events=24, rate='30Hz'):
+    """
+    Wall time of ``ls1016.User.loop`` and the dead time of each run
+
+    Returns
+    -------
+    results : dict
+        ``wall`` time of the loop, the number of ``runs``, their mean
+        ``dead_time``, the fraction of the loop spent taking data and the
+        number of times the DAQ was configured
+    """
+    control = control or sim.SimControlSystem()
+    ls1016 = _import_experiment('ls1016', control)
+    sim.patch_ls1016(ls1016, control)
+    user = ls1016.User()
+    start = time.perf_counter()
+    user.loop(delays=list(delays), nruns=nruns, light_events=light_events,
+              rate=rate)
+    wall = time.perf_counter() - start
+    ls1016.elog_queue.flush(timeout=10.)
+    runs = user.run_metrics
+    dead = [run['dead_time'] for run in runs]
+    acquire = sum(run['acquire'] for run in runs)
+    return {'wall': wall, 'runs': len(runs),
+            'dead_time': sum(dead) / len(dead) if dead else None,
+            'max_dead_time': max(dead) if dead else None,
+            'duty_cycle': acquire / wall if wall else None,
+            'daq_configures': control.daq.configures}
+
+
+def bench_profiler(messages=5000):
+    """
+    Overhead of ``mfx.profiling.MessageProfiler`` per message
+
+    Returns
+    -------
+    results : dict
+        Seconds per message with and without the profiler attached and the
+        ``overhead`` the profiler adds to each
+    """
+    from bluesky.plan_stubs import null
+    from .profiling import MessageProfiler
+
+    def plan():
+        for _ in range(messages):
+            yield from null()
+
+    RE = _run_engine()
+    start = time.perf_counter()
+    RE(plan())
+    bare = (time.perf_counter() - start) / messages
+    profiler = MessageProfiler()
+    profiler.attach(RE)
+    start = time.perf_counter()
+    RE(plan())
+    profiled = (time.perf_counter() - start) / messages
+    profiler.detach()
+    return {'bare': bare, 'profiled': profiled, 'overhead': profiled - bare}
+
+
+#: Name of each benchmark and the function that runs it
+BENCHMARKS = {'averaging': bench_averaging,
+              'tfs_scan': bench_tfs_scan,
+              'grid_scans': bench_grid_scans,
+              'ls1016_loop': bench_ls1016_loop,
+              'profiler': bench_profiler}
+
+
+def run(names=None):
+    """
+    Run benchmarks by name, all of them by default
+
+    A benchmark that fails is logged and reported with its error rather than
+    stopping the others
+    """
+    results = dict()
+    for name in names or BENCHMARKS:
+        logger.info("Running benchmark %s ...", name)
+        try:
+            results[name] = BENCHMARKS[name]()
+        except Exception as exc:
+            logger.exception("Benchmark %s failed", name)
+            results[name] = {'error': repr(exc)}
+    return results
+
+
+def _print(results, indent=0):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print('{}{}'.format(' ' * indent, key))
+            _print(value, indent=indent + 2)
+        elif isinstance(value, float):
+            print('{}{:<20} {:.4g}'.format(' ' * indent, key, value))
+        else:
+            print('{}{:<20} {}'.format(' ' * indent, key, value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline MFX benchmarks')
+    parser.add_argument('names', nargs='*',
+                        help='Benchmarks to run, all by default. One of {}'
+                             ''.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks {}'.format(', '.join(sorted(unknown))))
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args.names)
+    _print(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if any('error' in result for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Write device configuration only where it has changed
+"""
+import logging
+import functools
+import operator
+import threading
+
+from ophyd.status import Status
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigCache:
+    """
+    Remember the last configuration written to each device
+
+    ``configure`` compares the request against what was last written
+    through the cache and only sets the components that differ. All of the
+    sets are started at once and returned as a single combined status. A
+    failed write forgets that device so that it is written in full next
+    time. Anything that changes the devices outside of the cache should be
+    followed by ``invalidate``.
+
+    Example
+    -------
+    .. code::
+
+        cache = ConfigCache()
+        status = cache.configure(inhibit, {'eventcode': 211,
+                                           'ns_delay': 500000})
+        status.wait(timeout=5)
+    """
+    def __init__(self):
+        self._state = dict()
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.skipped = 0
+
+    @staticmethod
+    def _key(device):
+        return getattr(device, 'name', None) or id(device)
+
+    def diff(self, device, config):
+        """Entries of ``config`` that differ from the cached state"""
+        with self._lock:
+            cached = self._state.get(self._key(device), dict())
+            return {attr: value for attr, value in config.items()
+                    if attr not in cached or cached[attr] != value}
+
+    def configure(self, device, config):
+        """
+        Set only the components of ``device`` whose value has changed
+
+        Parameters
+        ----------
+        device : ophyd.Device
+
+        config : dict
+            Component attribute names and the values to set
+
+        Returns
+        -------
+        status : ophyd.status.StatusBase
+            Finished once every changed component has been set
+        """
+        changes = self.diff(device, config)
+        self.skipped += len(config) - len(changes)
+        if not changes:
+            return Status(done=True, success=True)
+        key = self._key(device)
+        with self._lock:
+            self._state.setdefault(key, dict()).update(changes)
+        logger.debug("Writing %s to %s", changes, key)
+        statuses = list()
+        for attr, value in changes.items():
+            statuses.append(getattr(device, attr).set(value))
+            self.writes += 1
+
+        def check(status):
+            if not status.success:
+                logger.warning("Failed to configure %s, forgetting its "
+                               "cached state", key)
+                self.invalidate(device)
+
+        status = functools.reduce(operator.and_, statuses)
+        status.add_callback(check)
+        return status
+
+    def configure_many(self, requests):
+        """
+        Configure several devices at once
+
+        Parameters
+        ----------
+        requests : iterable of tuple
+            Pairs of ``(device, config)``
+
+        Returns
+        -------
+        status : ophyd.status.StatusBase
+            Finished once every device has been configured
+        """
+        statuses = [self.configure(device, config)
+                    for device, config in requests]
+        if not statuses:
+            return Status(done=True, success=True)
+        return functools.reduce(operator.and_, statuses)
+
+    def invalidate(self, device=None):
+        """Forget the state of ``device``, or every device if None"""
+        with self._lock:
+            if device is None:
+                self._state.clear()
+            else:
+                self._state.pop(self._key(device), None)
@@ -1,6 +1,9 @@
-from ophyd import (Device, EpicsSignal, EpicsSignalRO, Component as C,
-                   FormattedComponent as FC)
-from ophyd.signal import AttributeSignal
+import functools
+import operator
+
+from ophyd import Device, EpicsSignal, EpicsSignalRO, Component as C
+from ophyd.signal import Signal
+from ophyd.status import wait as status_wait
 
 import pcdsdevices.device_types
 from pcdsdevices.inout import InOutPositioner
@@ -33,29 +36,142 @@ class Piezo(Device):
         return self.open_loop_step.set(distance)
 
 
+class ShutterState(Signal):
+    """
+    Read-only state of a ``LaserShutter``, only updated from its voltage
+    """
+    def _update(self, value):
+        super().put(value)
+
+    def put(self, value, **kwargs):
+        raise PermissionError("{} is read-only, move the shutter instead"
+                              "".format(self.name))
+
+    def set(self, value, **kwargs):
+        self.put(value)
+
+
 class LaserShutter(InOutPositioner):
-    """Controls shutter controlled by Analog Output"""
+    """
+    Controls shutter controlled by Analog Output
+
+    The voltage is monitored and ``state`` is updated from each new value,
+    so reading the state costs nothing and subscribers are told when it
+    changes. To keep noise on the channel from toggling the state, a
+    voltage has to cross ``barrier_voltage`` by ``hysteresis`` to change it.
+    The state is read-only, the shutter is moved by writing the voltage
+    """
     # EpicsSignals
-    voltage = C(EpicsSignal, '')
-    state = FC(AttributeSignal, 'voltage_check')
+    voltage = C(EpicsSignal, '', auto_monitor=True)
+    state = C(ShutterState, value='Unknown')
     # Constants
     out_voltage = 5.0
     in_voltage = 0.0
     barrier_voltage = 1.4
+    hysteresis = 0.2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.voltage.subscribe(self._voltage_changed)
+
+    def _voltage_changed(self, *args, value=None, **kwargs):
+        """Update the state from a new voltage"""
+        if value is None:
+            return
+        current = self.state.get()
+        state = self.state_from_voltage(value, current=current)
+        if state != current:
+            self.state._update(state)
 
     @property
     def voltage_check(self):
         """Return the position we believe shutter based on the channel"""
-        if self.voltage.get() >= self.barrier_voltage:
+        state = self.state.get()
+        if state not in ('IN', 'OUT'):
+            state = self.state_from_voltage(self.voltage.get())
+        return state
+
+    def state_from_voltage(self, voltage, current=None):
+        """
+        Return the state a given channel voltage corresponds to
+
+        If the ``current`` state is given the voltage must pass the barrier
+        by ``hysteresis`` to leave it
+        """
+        barrier = self.barrier_voltage
+        if current == 'OUT':
+            barrier -= self.hysteresis
+        elif current == 'IN':
+            barrier += self.hysteresis
+        if voltage >= barrier:
             return 'OUT'
         else:
             return 'IN'
 
+    def voltage_for(self, state):
+        """Return the channel voltage for a state name"""
+        if state == 'IN':
+            return self.in_voltage
+        elif state == 'OUT':
+            return self.out_voltage
+        else:
+            raise ValueError("%s is in an invalid state" % state)
+
     def _do_move(self, state):
         """Override to just put to the channel"""
-        if state.name == 'IN':
-            self.voltage.put(self.in_voltage)
-        elif state.name == 'OUT':
-            self.voltage.put(self.out_voltage)
-        else:
-            raise ValueError("%s is in an invalid state", state)
+        self.voltage.put(self.voltage_for(state.name))
+
+
+class ShutterGroup:
+    """
+    Move and read a group of LaserShutters together
+
+    All of the channels are written at once and a single status is returned
+    that finishes when every channel has reached its voltage. Reading the
+    group uses the monitored state of each shutter.
+
+    Parameters
+    ----------
+    shutters : LaserShutter
+    """
+    def __init__(self, *shutters, name=None):
+        self.shutters = shutters
+        self.name = name
+
+    def set(self, states):
+        """
+        Move every shutter at once
+
+        Parameters
+        ----------
+        states : iterable
+            One entry per shutter, either ``'IN'``, ``'OUT'`` or a bool where
+            True means ``'OUT'``
+
+        Returns
+        -------
+        status : ophyd.status.StatusBase
+            Finished once every shutter channel reads back its voltage
+        """
+        states = list(states)
+        if len(states) != len(self.shutters):
+            raise ValueError("Expected {} states, received {}"
+                             "".format(len(self.shutters), len(states)))
+        statuses = list()
+        for shutter, state in zip(self.shutters, states):
+            if isinstance(state, bool):
+                state = 'OUT' if state else 'IN'
+            statuses.append(shutter.voltage.set(shutter.voltage_for(state)))
+        return functools.reduce(operator.and_, statuses)
+
+    def move(self, states, wait=False, timeout=None):
+        """Move every shutter at once, optionally waiting for completion"""
+        status = self.set(states)
+        if wait:
+            status_wait(status, timeout=timeout)
+        return status
+
+    @property
+    def state(self):
+        """State of every shutter"""
+        return [shutter.voltage_check for shutter in self.shutters]
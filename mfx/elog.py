@@ -0,0 +1,214 @@
+"""
+Post to the ELog from a background thread
+
+The run loops should never wait on, or fail because of, the ELog. Posts are
+queued and sent by a worker thread in batches, failed posts are retried with
+an exponential backoff, and anything not yet sent is kept in a spool file so
+that it survives a restart of the session.
+
+Each session spools to its own file next to the requested path, held with a
+lock while the session runs. A new session resends the spools of sessions
+that are no longer running, so concurrent sessions never touch each other's
+posts.
+"""
+import os
+import glob
+import json
+import fcntl
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ElogQueue:
+    """
+    Non-blocking queue of ELog posts
+
+    Parameters
+    ----------
+    elog : object
+        Anything with a ``post(msg, **kwargs)`` method, e.g. the hutch
+        python ``elog``
+
+    spool : str, optional
+        File holding the posts that have not been sent yet. The process id is
+        added to the name so every session has its own. Posts left by
+        sessions that have ended are queued again
+
+    batch_size : int, optional
+        Maximum number of posts sent before the spool is rewritten
+
+    backoff : float, optional
+        First delay after a failed post. Doubles on each failure
+
+    max_backoff : float, optional
+        Longest delay between attempts
+    """
+    def __init__(self, elog, spool=None, batch_size=10, backoff=1.,
+                 max_backoff=300.):
+        self.elog = elog
+        self.spool = None
+        self._spool_lock = None
+        self.batch_size = batch_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.failures = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._running = True
+        if spool:
+            self._claim_spools(spool)
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='mfx-elog')
+        self._thread.start()
+
+    def post(self, msg, **kwargs):
+        """Queue a post and return immediately"""
+        with self._lock:
+            self._queue.append({'msg': msg, 'kwargs': kwargs,
+                                'queued': time.time()})
+            self._idle.clear()
+        self._wake.set()
+
+    @property
+    def pending(self):
+        """Number of posts not yet sent"""
+        return len(self._queue)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued post has been sent
+
+        Returns
+        -------
+        done : bool
+            False if the timeout expired first
+        """
+        self._wake.set()
+        return self._idle.wait(timeout=timeout)
+
+    def stop(self):
+        """Stop the worker, leaving unsent posts in the spool"""
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+
+    @staticmethod
+    def _lock_spool(path):
+        """Lock file guarding ``path``, None if another session holds it"""
+        fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _claim_spools(self, spool):
+        """Take a spool of our own and queue the posts of ended sessions"""
+        root, ext = os.path.splitext(spool)
+        try:
+            directory = os.path.dirname(spool)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.spool = '{}.{}{}'.format(root, os.getpid(), ext)
+            self._spool_lock = self._lock_spool(self.spool)
+        except OSError:
+            logger.exception("Unable to create ELog spool %s", spool)
+            self.spool = None
+            return
+        others = [spool] + glob.glob('{}.*{}'.format(root, ext))
+        for path in others:
+            if not os.path.exists(path):
+                continue
+            # Our own name may be left by an ended session with the same pid
+            own = path == self.spool
+            fd = None if own else self._lock_spool(path)
+            if fd is None and not own:
+                # Still in use by a running session
+                continue
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        if line.strip():
+                            self._queue.append(json.loads(line))
+                if not own:
+                    os.unlink(path)
+                    os.unlink(path + '.lock')
+            except (OSError, ValueError):
+                logger.exception("Unable to read ELog spool %s", path)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+        if self._queue:
+            logger.info("Resending %s ELog posts left by earlier sessions",
+                        len(self._queue))
+            self._idle.clear()
+            self._write_spool(list(self._queue))
+
+    def _write_spool(self, items):
+        """Write ``items`` to the spool, never called with the lock held"""
+        if not self.spool:
+            return
+        try:
+            tmp = self.spool + '.tmp'
+            with open(tmp, 'w') as f:
+                for item in items:
+                    f.write(json.dumps(item) + '\n')
+            os.replace(tmp, self.spool)
+        except (OSError, TypeError, ValueError):
+            logger.exception("Unable to write ELog spool %s", self.spool)
+
+    def _run(self):
+        delay = self.backoff
+        while self._running:
+            with self._lock:
+                empty = not self._queue
+                if empty:
+                    self._idle.set()
+            if empty:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            if self._send_batch():
+                delay = self.backoff
+            else:
+                logger.warning("ELog post failed, retrying in %.0f s", delay)
+                self._wake.wait(timeout=delay)
+                self._wake.clear()
+                delay = min(2 * delay, self.max_backoff)
+
+    def _send_batch(self):
+        """Send up to ``batch_size`` posts, False if one of them failed"""
+        success = True
+        # Persist anything queued since the last batch before sending. Only
+        # a snapshot is taken with the lock, post never waits on the disk
+        with self._lock:
+            snapshot = list(self._queue)
+        self._write_spool(snapshot)
+        for _ in range(self.batch_size):
+            with self._lock:
+                if not self._queue:
+                    break
+                item = self._queue[0]
+            try:
+                self.elog.post(item['msg'], **item['kwargs'])
+            except Exception:
+                logger.debug("ELog post failed", exc_info=True)
+                self.failures += 1
+                success = False
+                break
+            with self._lock:
+                self._queue.popleft()
+            self.sent += 1
+        with self._lock:
+            snapshot = list(self._queue)
+        self._write_spool(snapshot)
+        return success
@@ -0,0 +1,323 @@
+"""
+Run scripts in forks of a warm interpreter
+
+Starting a script with ``mfxrun`` normally means a fresh interpreter that
+imports its heavy dependencies again before anything useful happens. The
+fork server imports them once and then forks a child for every script it is
+asked to run, so each script starts with those modules already loaded but
+otherwise with a clean interpreter of its own.
+
+The client hands its stdin, stdout and stderr to the server over the socket,
+along with its arguments, working directory and environment. The child runs
+in a new session attached to those descriptors, and its exit status is sent
+back to the client. Signals received by the client, e.g. a Ctrl-C, are
+forwarded to the child.
+
+Only modules that neither start threads nor create a Channel Access context
+can be preloaded. Importing pyepics, bluesky or event_model does neither, so
+they are preloaded along with numpy. Importing ophyd sets up its control
+layer, which creates a libca context and its dispatcher threads, and neither
+survives a fork. So ophyd and pcdsdevices, which imports it, are imported by
+each child, and the server refuses to start if preloading left any threads
+running. Modules in
+this repository are not preloaded either, so edits are picked up without
+restarting the server. The child builds ``sys.path`` from the client's
+``PYTHONPATH``, so a development checkout is used as it would be by a fresh
+interpreter.
+
+Example
+-------
+.. code::
+
+    # Start the server once
+    python -m mfx.forkserver serve --socket ~/.mfx_forkserver &
+    # mfxrun uses it when MFX_FORKSERVER is set
+    export MFX_FORKSERVER=~/.mfx_forkserver
+    mfxrun take_pedestal.py
+"""
+import os
+import sys
+import json
+import time
+import array
+import runpy
+import signal
+import socket
+import struct
+import logging
+import argparse
+import importlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+#: Modules imported by the server before it starts accepting scripts. None
+#: of them may start a thread or a Channel Access context
+PRELOAD = ('numpy', 'epics', 'event_model', 'bluesky', 'bluesky.plans')
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.mfx_forkserver')
+
+# Descriptors handed from the client to the child
+_FDS = (0, 1, 2)
+_HEADER = struct.Struct('!I')
+
+
+def preload(modules=PRELOAD):
+    """
+    Import ``modules``, skipping any that are not installed
+
+    Returns
+    -------
+    elapsed : dict
+        Seconds taken to import each module
+    """
+    elapsed = dict()
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.warning("Unable to preload %s", name)
+            continue
+        elapsed[name] = time.perf_counter() - start
+        logger.info("Preloaded %s in %.2f s", name, elapsed[name])
+    return elapsed
+
+
+def _recv_exact(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by client")
+        data += chunk
+    return data
+
+
+def _recv_request(conn):
+    """Read the descriptors and request sent by ``run``"""
+    fds = array.array('i')
+    msg, ancdata, flags, addr = conn.recvmsg(
+                    _HEADER.size, socket.CMSG_LEN(len(_FDS) * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    if len(fds) != len(_FDS) or len(msg) != _HEADER.size:
+        for fd in fds:
+            os.close(fd)
+        raise ConnectionError("Malformed request")
+    size, = _HEADER.unpack(msg)
+    request = json.loads(_recv_exact(conn, size).decode())
+    return list(fds), request
+
+
+def _pythonpath(env):
+    """Absolute entries of the ``PYTHONPATH`` in ``env``"""
+    return [os.path.abspath(entry)
+            for entry in env.get('PYTHONPATH', '').split(os.pathsep)
+            if entry]
+
+
+# Interpreter path of the server without its own PYTHONPATH
+_BASE_PATH = [entry for entry in sys.path[1:]
+              if entry not in _pythonpath(os.environ)]
+
+
+def _client_path(script, env):
+    """``sys.path`` a fresh interpreter of the client would have"""
+    return ([os.path.dirname(os.path.abspath(script))] + _pythonpath(env)
+            + _BASE_PATH)
+
+
+def _run_child(fds, request):
+    """Become the script described by ``request``, never returns"""
+    code = 1
+    try:
+        os.setsid()
+        for fd, target in zip(fds, _FDS):
+            os.dup2(fd, target)
+            os.close(fd)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Leave logging for the script to configure
+        for handler in list(logging.root.handlers):
+            logging.root.removeHandler(handler)
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.chdir(request['cwd'])
+        script = request['argv'][0]
+        sys.argv = list(request['argv'])
+        sys.path[:] = _client_path(script, request['env'])
+        importlib.invalidate_caches()
+        try:
+            runpy.run_path(script, run_name='__main__')
+            code = 0
+        except SystemExit as exc:
+            if exc.code is None:
+                code = 0
+            elif isinstance(exc.code, int):
+                code = exc.code
+            else:
+                print(exc.code, file=sys.stderr)
+                code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _reap(conn, pid, active):
+    """Wait for a child and send its exit status to the client"""
+    try:
+        _, status = os.waitpid(pid, 0)
+        if os.WIFSIGNALED(status):
+            code = 128 + os.WTERMSIG(status)
+        else:
+            code = os.WEXITSTATUS(status)
+        conn.sendall('exit {}\n'.format(code).encode())
+    except OSError:
+        logger.debug("Unable to report exit of %s", pid, exc_info=True)
+    finally:
+        active.discard(conn)
+        conn.close()
+
+
+def serve(path=DEFAULT_SOCKET, modules=PRELOAD):
+    """
+    Preload ``modules`` and run scripts sent to the socket at ``path``
+
+    The socket is only accessible by the user running the server
+    """
+    preload(modules)
+    # Threads are not copied by fork, anything that needs them would hang
+    threads = [thread.name for thread in threading.enumerate()
+               if thread is not threading.main_thread()]
+    if threads:
+        raise RuntimeError("Preloading started threads {}, these modules "
+                           "can not be used in forked children"
+                           "".format(', '.join(threads)))
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    logger.info("Fork server listening on %s", path)
+    # Connections of scripts still running, closed in every new child
+    active = set()
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                fds, request = _recv_request(conn)
+            except (OSError, ValueError, KeyError):
+                logger.exception("Rejected request")
+                conn.close()
+                continue
+            # Nothing buffered may be written twice
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                conn.close()
+                for other in list(active):
+                    other.close()
+                _run_child(fds, request)
+            for fd in fds:
+                os.close(fd)
+            logger.info("Running %s as %s", request['argv'][0], pid)
+            try:
+                conn.sendall('pid {}\n'.format(pid).encode())
+            except OSError:
+                pass
+            active.add(conn)
+            threading.Thread(target=_reap, args=(conn, pid, active),
+                             daemon=True).start()
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def _fallback(argv):
+    """Run ``argv`` in a fresh interpreter instead"""
+    os.execv(sys.executable, [sys.executable] + list(argv))
+
+
+def run(argv, path=DEFAULT_SOCKET):
+    """
+    Run a script on the fork server and return its exit code
+
+    Falls back to a fresh interpreter, replacing this process, when the
+    server can not be reached or ``argv`` is not a plain script, e.g. when
+    it starts with ``-m`` or ``-c``
+    """
+    if not argv or argv[0].startswith('-') or not os.path.isfile(argv[0]):
+        _fallback(argv)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        logger.debug("No fork server at %s", path, exc_info=True)
+        conn.close()
+        _fallback(argv)
+    request = json.dumps({'argv': list(argv), 'cwd': os.getcwd(),
+                          'env': dict(os.environ)}).encode()
+    conn.sendmsg([_HEADER.pack(len(request))],
+                 [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                   array.array('i', _FDS))])
+    conn.sendall(request)
+    reader = conn.makefile('r')
+    line = reader.readline().split()
+    if not line or line[0] != 'pid':
+        raise ConnectionError("Fork server did not start {}".format(argv[0]))
+    pid = int(line[1])
+
+    # Pass on anything meant for the script
+    def forward(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, forward)
+    line = reader.readline().split()
+    conn.close()
+    if not line or line[0] != 'exit':
+        raise ConnectionError("Lost the fork server while running {}"
+                              "".format(argv[0]))
+    return int(line[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mfxrun fork server')
+    sub = parser.add_subparsers(dest='command')
+    serve_parser = sub.add_parser('serve', help='Start the server')
+    serve_parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    serve_parser.add_argument('--preload', nargs='*', default=PRELOAD,
+                              help='Modules to import before serving')
+    run_parser = sub.add_parser('run', help='Run a script on the server')
+    run_parser.add_argument('--socket', default=os.environ.get(
+                                'MFX_FORKSERVER', DEFAULT_SOCKET))
+    run_parser.add_argument('argv', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    if args.command == 'serve':
+        logging.basicConfig(level=logging.INFO)
+        serve(path=os.path.expanduser(args.socket), modules=args.preload)
+    elif args.command == 'run':
+        sys.exit(run(args.argv, path=os.path.expanduser(args.socket)))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
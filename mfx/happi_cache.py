@@ -0,0 +1,248 @@
+"""
+Local cache of the shared happi database split by beamline
+
+The shared ``db.json`` lives on a network filesystem and holds every device
+at the facility. The cache splits it once into a small file per beamline,
+each a valid happi JSON database on its own, alongside an index of the
+device names in each. The cache is tied to the modification time and size
+of the source file, optionally its hash as well, and is rebuilt whenever the
+source changes. If the cache can not be used the full file is read instead.
+
+Example
+-------
+.. code::
+
+    cache = HappiCache()
+    entries = cache.load('MFX', names=['mfx_dg1_pim'])
+
+From the shell ``python -m mfx.happi_cache MFX`` refreshes the cache and
+prints the path of the MFX database.
+
+``mfxpython`` still reads the shared file named in ``conf.yml``, as the
+lightpath built by hutch-python needs the devices of every beamline upstream
+of MFX. The cache is for ``mfxrun`` scripts and tools that only need MFX
+devices, e.g. ``happi.Client(path=HappiCache().path('MFX'))``.
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = '/reg/g/pcds/pyps/apps/hutch-python/device_config/db.json'
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'mfx',
+                             'happi')
+
+
+def _write_json(path, data):
+    """Write ``data`` so that readers never see a partial file"""
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class HappiCache:
+    """
+    Per beamline snapshot of a happi JSON database
+
+    Parameters
+    ----------
+    source : str, optional
+        Path to the full happi database
+
+    cache_dir : str, optional
+        Directory to hold the cached files
+
+    verify_hash : bool, optional
+        Also compare the SHA-256 of the source file when validating. This
+        reads the whole file so is off by default
+    """
+    def __init__(self, source=DEFAULT_DB, cache_dir=DEFAULT_CACHE,
+                 verify_hash=False):
+        self.source = source
+        self.cache_dir = cache_dir
+        self.verify_hash = verify_hash
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def _beamline_path(self, beamline):
+        return os.path.join(self.cache_dir, '{}.json'.format(beamline))
+
+    def _stamp(self):
+        stat = os.stat(self.source)
+        stamp = {'source': os.path.abspath(self.source),
+                 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+        if self.verify_hash:
+            stamp['sha256'] = self._hash()
+        return stamp
+
+    def _hash(self):
+        sha = hashlib.sha256()
+        with open(self.source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_valid(self):
+        """Whether the cache matches the current source file"""
+        index = self._read_index()
+        if index is None:
+            return False
+        stamp = index.get('stamp', {})
+        try:
+            current = self._stamp()
+        except OSError:
+            return False
+        if self.verify_hash and 'sha256' not in stamp:
+            return False
+        return all(stamp.get(key) == value for key, value in current.items())
+
+    def rebuild(self):
+        """
+        Split the source database into one file per beamline
+
+        Returns
+        -------
+        index : dict
+            Stamp of the source file and the device names per beamline
+        """
+        logger.info("Rebuilding happi cache of %s ...", self.source)
+        # Take the stamp first so a change while reading invalidates us
+        stamp = self._stamp()
+        with open(self.source, 'r') as f:
+            db = json.load(f)
+        split = dict()
+        for _id, entry in db.items():
+            beamline = str(entry.get('beamline') or 'NONE').upper()
+            split.setdefault(beamline, dict())[_id] = entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index = {'stamp': stamp, 'beamlines': dict()}
+        for beamline, entries in split.items():
+            _write_json(self._beamline_path(beamline), entries)
+            index['beamlines'][beamline] = sorted(
+                    str(entry.get('name', _id))
+                    for _id, entry in entries.items())
+        # Written last, so the index is only valid once all files exist
+        _write_json(self.index_path, index)
+        # Beamlines no longer in the source
+        for filename in os.listdir(self.cache_dir):
+            beamline, ext = os.path.splitext(filename)
+            if (ext == '.json' and filename != 'index.json'
+                    and beamline not in split):
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    logger.warning("Unable to remove stale %s", filename)
+        return index
+
+    def _cached(self, beamline):
+        """Whether the valid cache has a file for ``beamline``"""
+        if not self.ensure():
+            return False
+        index = self._read_index()
+        return index is not None and beamline in index['beamlines']
+
+    def ensure(self):
+        """
+        Rebuild the cache if it is stale
+
+        Returns
+        -------
+        valid : bool
+            False if the cache could not be brought up to date
+        """
+        if self.is_valid():
+            return True
+        try:
+            self.rebuild()
+        except (OSError, ValueError):
+            logger.exception("Unable to rebuild happi cache in %s",
+                             self.cache_dir)
+            return False
+        return True
+
+    def path(self, beamline):
+        """
+        Path to a happi database holding only ``beamline`` devices
+
+        Falls back to the full source database if the cache is unusable
+        """
+        beamline = beamline.upper()
+        if self._cached(beamline):
+            return self._beamline_path(beamline)
+        return self.source
+
+    def names(self, beamline):
+        """Names of the devices cached for ``beamline``"""
+        beamline = beamline.upper()
+        if self.ensure():
+            return self._read_index()['beamlines'].get(beamline, [])
+        entries = self._load_source(beamline)
+        return sorted(str(entry.get('name', _id))
+                      for _id, entry in entries.items())
+
+    def _load_source(self, beamline):
+        with open(self.source, 'r') as f:
+            db = json.load(f)
+        return {_id: entry for _id, entry in db.items()
+                if str(entry.get('beamline') or 'NONE').upper() == beamline}
+
+    def load(self, beamline, names=None):
+        """
+        Entries of the database for a beamline
+
+        Parameters
+        ----------
+        beamline : str
+            Beamline to load, case insensitive
+
+        names : iterable of str, optional
+            Only return devices with these names
+
+        Returns
+        -------
+        entries : dict
+            Happi entries keyed by ``_id``
+        """
+        beamline = beamline.upper()
+        entries = None
+        if self.ensure():
+            index = self._read_index()
+            if index is not None and beamline not in index['beamlines']:
+                entries = dict()
+            else:
+                try:
+                    with open(self._beamline_path(beamline), 'r') as f:
+                        entries = json.load(f)
+                except (OSError, ValueError):
+                    logger.exception("Unable to read cached %s devices, "
+                                     "using the full database", beamline)
+        if entries is None:
+            entries = self._load_source(beamline)
+        if names is not None:
+            names = set(names)
+            entries = {_id: entry for _id, entry in entries.items()
+                       if entry.get('name') in names}
+        return entries
+
+
+if __name__ == '__main__':
+    print(HappiCache().path(sys.argv[1] if len(sys.argv) > 1 else 'MFX'))
@@ -0,0 +1,128 @@
+"""
+Deferred construction of beamline devices
+
+Devices wrapped in a ``LazyDevice`` are not imported, created or connected
+until an attribute is first accessed. Startup then only pays for the
+devices that are actually used, while ``warm`` can build and connect the
+rest in the background.
+"""
+import logging
+import threading
+
+from hutch_python.utils import safe_load
+
+from .startup import timeline
+
+logger = logging.getLogger(__name__)
+
+
+class LazyDevice:
+    """
+    Proxy that builds a device on first attribute access
+
+    Parameters
+    ----------
+    name : str
+        Name used when reporting load failures
+
+    factory : callable
+        Called with no arguments to build the device. Any imports the device
+        needs should happen inside the factory so they are deferred as well
+
+    Example
+    -------
+    .. code::
+
+        def _tfs():
+            from transfocate import Transfocator
+            return Transfocator("MFX:LENS", name='MFX Transfocator')
+
+        tfs = LazyDevice('transfocator', _tfs)
+    """
+    _own_attrs = ('_lazy_name', '_lazy_factory', '_lazy_obj',
+                  '_lazy_loaded', '_lazy_lock')
+
+    def __init__(self, name, factory):
+        object.__setattr__(self, '_lazy_name', name)
+        object.__setattr__(self, '_lazy_factory', factory)
+        object.__setattr__(self, '_lazy_obj', None)
+        object.__setattr__(self, '_lazy_loaded', False)
+        object.__setattr__(self, '_lazy_lock', threading.RLock())
+
+    @property
+    def loaded(self):
+        """Whether the device has been built"""
+        return self._lazy_loaded
+
+    def load(self):
+        """Build the device if it has not been already and return it"""
+        with self._lazy_lock:
+            if not self._lazy_loaded:
+                obj = None
+                with timeline.stage(self._lazy_name):
+                    with safe_load(self._lazy_name):
+                        obj = self._lazy_factory()
+                object.__setattr__(self, '_lazy_obj', obj)
+                object.__setattr__(self, '_lazy_loaded', True)
+        if self._lazy_obj is None:
+            raise RuntimeError("{} failed to load, see the log for details"
+                               "".format(self._lazy_name))
+        return self._lazy_obj
+
+    def warm(self, timeout=10.0):
+        """
+        Build and connect the device
+
+        Load failures and connection timeouts are logged rather than raised
+        """
+        try:
+            obj = self.load()
+        except RuntimeError:
+            return
+        wait = getattr(obj, 'wait_for_connection', None)
+        if wait is not None:
+            try:
+                wait(timeout=timeout)
+            except Exception as exc:
+                logger.warning("%s did not connect: %s", self._lazy_name, exc)
+            timeline.record_connections(self._lazy_name, obj)
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __dir__(self):
+        if self._lazy_loaded and self._lazy_obj is not None:
+            return dir(self._lazy_obj)
+        return super().__dir__()
+
+    def __repr__(self):
+        if self._lazy_loaded and self._lazy_obj is not None:
+            return repr(self._lazy_obj)
+        return '<LazyDevice {!r} ({})>'.format(
+                    self._lazy_name,
+                    'failed' if self._lazy_loaded else 'not loaded')
+
+
+def warm(*devices, timeout=10.0):
+    """
+    Build and connect lazy devices in a background thread
+
+    The startup timeline is written out once every device is done, see
+    ``mfx.startup``.
+
+    Returns
+    -------
+    thread : threading.Thread
+        Join this to wait for every device to finish
+    """
+    def run():
+        for device in devices:
+            device.warm(timeout=timeout)
+        timeline.finish()
+
+    thread = threading.Thread(target=run, daemon=True, name='mfx-warm')
+    thread.start()
+    return thread
@@ -0,0 +1,322 @@
+"""
+Precomputed index of transfocator and prefocus lens combinations
+
+Finding the lenses that focus to a given position means evaluating every
+combination of the prefocus stacks and transfocator lenses. The index does
+this once over a grid of energies and keeps, for each energy, the focal
+positions of every combination in sorted order, along with the largest
+change of any focal position between neighboring grid energies. A lookup
+bisects the grid for the two energies either side of the request, and only
+the combinations whose focus there lies close enough to the target to
+possibly be the best are checked exactly at the requested energy. Energies
+outside the grid are refused. Indices are stored on disk under a key derived
+from the lens configuration, so a change to the lenses or grid builds a new
+one.
+
+Example
+-------
+.. code::
+
+    index = LensIndex.from_transfocator(tfs, source_z=0.)
+    combo = index.lookup(focus_z=405.2, energy=9.5)
+"""
+import os
+import json
+import hashlib
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'mfx',
+                             'lenses')
+
+# Classical electron radius, Avogadro, hc in keV * m
+_r_e = 2.8179403262e-15
+_N_A = 6.02214076e23
+_hc = 1.23984198e-9
+# Beryllium density in g/cm^3, atomic number and mass
+_BE = (1.848, 4, 9.0121831)
+
+
+def delta(energy, material=_BE):
+    """
+    Refractive index decrement at an energy in keV, Beryllium by default
+
+    Uses the free electron approximation, good well above the absorption
+    edges of the lens material
+    """
+    density, Z, A = material
+    # Electrons per cubic meter
+    n_e = density * 1e6 * _N_A * Z / A
+    wavelength = _hc / np.asarray(energy, dtype=float)
+    return _r_e * wavelength**2 * n_e / (2 * np.pi)
+
+
+def focal_length(radius, energy):
+    """Focal length in meters of a lens with ``radius`` in microns"""
+    return radius * 1e-6 / (2 * delta(energy))
+
+
+Lens = namedtuple('Lens', ['radius', 'z'])
+Lens.__doc__ = """Single lens with radius in microns and position in meters"""
+
+Combination = namedtuple('Combination', ['prefocus', 'lenses', 'focus'])
+Combination.__doc__ = """Prefocus name, transfocator lens indices and focus"""
+
+
+def _value(item):
+    """Read a value that may be an ophyd signal"""
+    return item.get() if hasattr(item, 'get') else item
+
+
+class LensIndex:
+    """
+    Sorted focal positions of every lens combination over an energy grid
+
+    Parameters
+    ----------
+    prefocus : dict
+        Prefocus stack name to ``Lens``. A stack named ``None`` is always
+        added to represent no prefocus
+
+    lenses : list of Lens
+        Transfocator lenses, any subset of which may be inserted
+
+    source_z : float, optional
+        Position of the source in meters
+
+    energies : tuple, optional
+        ``(start, stop, step)`` of the energy grid in keV
+
+    cache_dir : str, optional
+        Where to store built indices. ``None`` disables the disk cache
+    """
+    def __init__(self, prefocus, lenses, source_z=0.,
+                 energies=(4., 25., 0.05), cache_dir=DEFAULT_CACHE):
+        self.prefocus = {name: Lens(*lens) for name, lens in prefocus.items()}
+        self.prefocus_names = [None] + sorted(self.prefocus)
+        self.lenses = [Lens(*lens) for lens in lenses]
+        self.source_z = source_z
+        start, stop, step = energies
+        self.energies = np.arange(start, stop + step / 2, step)
+        self.cache_dir = cache_dir
+        self._build_masks()
+        if not self._load():
+            self.build()
+            self._save()
+
+    @classmethod
+    def from_transfocator(cls, tfs, prefocus_names=('6K70', '7K50', '9K45'),
+                          **kwargs):
+        """
+        Build from a ``transfocate.Transfocator``
+
+        The ``xrt_lenses`` of the transfocator are the prefocus stacks, named
+        in order by ``prefocus_names``, and the ``tfs_lenses`` are the
+        transfocator lenses. Each lens is read for its ``radius`` and ``z``
+        """
+        prefocus = {name: Lens(_value(lens.radius), _value(lens.z))
+                    for name, lens in zip(prefocus_names, tfs.xrt_lenses)}
+        lenses = [Lens(_value(lens.radius), _value(lens.z))
+                  for lens in tfs.tfs_lenses]
+        return cls(prefocus, lenses, **kwargs)
+
+    @property
+    def key(self):
+        """Hash of everything the index depends on"""
+        config = {'prefocus': sorted((name, list(lens)) for name, lens
+                                     in self.prefocus.items()),
+                  'lenses': [list(lens) for lens in self.lenses],
+                  'source_z': self.source_z,
+                  'energies': [float(self.energies[0]),
+                               float(self.energies[-1]),
+                               len(self.energies)]}
+        encoded = json.dumps(config, sort_keys=True).encode()
+        return hashlib.sha1(encoded).hexdigest()[:16]
+
+    @property
+    def path(self):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir,
+                            'lens_index_{}.npz'.format(self.key))
+
+    def _build_masks(self):
+        """Table of which lens each combination uses"""
+        nlens = len(self.lenses)
+        subsets = ((np.arange(2**nlens)[:, np.newaxis]
+                    >> np.arange(nlens)) & 1).astype(bool)
+        rows = list()
+        for name in self.prefocus_names:
+            pre = np.zeros((len(subsets), 1), dtype=bool)
+            pre[:] = name is not None
+            rows.append((name, np.hstack([pre, subsets])))
+        self.combo_prefocus = np.concatenate(
+                [np.full(len(mask), i) for i, (name, mask) in enumerate(rows)])
+        self.combo_masks = np.vstack([mask for name, mask in rows])
+
+    def focus(self, energy, combos=None):
+        """
+        Focal position of combinations at a single energy
+
+        Parameters
+        ----------
+        energy : float
+            Energy in keV
+
+        combos : array of int, optional
+            Rows of the combination table, all of them by default
+        """
+        if combos is None:
+            combos = np.arange(len(self.combo_masks))
+        combos = np.asarray(combos)
+        masks = self.combo_masks[combos]
+        # Every combination has its own prefocus lens in the first column
+        pre = [self.prefocus.get(name) for name in self.prefocus_names]
+        pre_radius = np.array([lens.radius if lens else np.inf
+                               for lens in pre])[self.combo_prefocus[combos]]
+        pre_z = np.array([lens.z if lens else 0. for lens in pre]
+                         )[self.combo_prefocus[combos]]
+        radii = np.column_stack([pre_radius]
+                                + [np.full(len(combos), lens.radius)
+                                   for lens in self.lenses])
+        zs = np.column_stack([pre_z] + [np.full(len(combos), lens.z)
+                                        for lens in self.lenses])
+        image = np.full(len(combos), float(self.source_z))
+        # Image through each lens in beam order
+        order = np.argsort(zs, axis=1, kind='stable')
+        rows = np.arange(len(combos))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for column in range(zs.shape[1]):
+                idx = order[:, column]
+                use = masks[rows, idx]
+                z = zs[rows, idx]
+                f = focal_length(radii[rows, idx], energy)
+                u = z - image
+                v = 1. / (1. / f - 1. / u)
+                image = np.where(use, z + v, image)
+        # Combinations with no lenses do not focus
+        image[~masks.any(axis=1)] = np.nan
+        return image
+
+    def build(self):
+        """Compute and sort the focal positions over the energy grid"""
+        logger.info("Building lens index over %s combinations and %s "
+                    "energies ...", len(self.combo_masks), len(self.energies))
+        focus = np.vstack([self.focus(energy) for energy in self.energies])
+        # NaN sort to the end of each row
+        self.order = np.argsort(focus, axis=1, kind='stable')
+        self.sorted_focus = np.take_along_axis(focus, self.order, axis=1)
+        self.valid = np.count_nonzero(np.isfinite(self.sorted_focus), axis=1)
+        # Largest move of any focus from one grid energy to the next
+        with np.errstate(invalid='ignore'):
+            step = np.abs(np.diff(focus, axis=0))
+        step[np.isnan(step)] = np.inf
+        changed = np.isfinite(focus[1:]) | np.isfinite(focus[:-1])
+        step[~changed] = 0.
+        self.shift = (step.max(axis=1) if len(step)
+                      else np.zeros(0))
+
+    def _load(self):
+        path = self.path
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                self.order = data['order']
+                self.sorted_focus = data['sorted_focus']
+                self.valid = data['valid']
+                self.shift = data['shift']
+        except (OSError, KeyError, ValueError):
+            logger.warning("Unable to load lens index %s, rebuilding", path)
+            return False
+        return True
+
+    def _save(self):
+        path = self.path
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = path + '.tmp.npz'
+            np.savez(tmp, order=self.order, sorted_focus=self.sorted_focus,
+                     valid=self.valid, shift=self.shift)
+            os.replace(tmp, path)
+        except OSError:
+            logger.exception("Unable to save lens index to %s", path)
+
+    def lookup(self, focus_z, energy, neighbors=4):
+        """
+        Combination that focuses closest to ``focus_z`` at ``energy``
+
+        The nearest ``neighbors`` entries in the sorted list of each grid
+        energy either side of ``energy`` give a first best error. Every
+        combination whose focus at those energies is within that error plus
+        the largest focal shift between them is then checked exactly. This
+        gives the same result as checking every combination, as long as each
+        focus moves monotonically between neighboring grid energies. A
+        ``ValueError`` is raised for energies outside the grid
+
+        Parameters
+        ----------
+        focus_z : float
+            Requested focal position in meters
+
+        energy : float
+            Beam energy in keV
+
+        neighbors : int, optional
+            Entries either side of the indexed match used for the first
+            estimate
+
+        Returns
+        -------
+        combination : Combination
+        """
+        first, last = self.energies[0], self.energies[-1]
+        # The ends of the grid carry the rounding of np.arange
+        if not (first <= energy <= last
+                or np.isclose(energy, [first, last]).any()):
+            raise ValueError("Energy {} keV is outside the indexed grid of "
+                             "{:g} to {:g} keV".format(energy, first, last))
+        hi = int(np.clip(np.searchsorted(self.energies, energy), 0,
+                         len(self.energies) - 1))
+        lo = max(hi - 1, 0) if self.energies[hi] > energy else hi
+        rows = sorted({lo, hi})
+        if not any(self.valid[row] for row in rows):
+            raise ValueError("No lens combination focuses at {} keV"
+                             "".format(energy))
+        shift = self.shift[lo] if hi != lo else 0.
+        # First estimate from the closest entries of each grid energy
+        candidates = list()
+        for row in rows:
+            valid = self.valid[row]
+            j = np.searchsorted(self.sorted_focus[row, :valid], focus_z)
+            candidates.append(self.order[row, max(j - neighbors, 0):
+                                         min(j + neighbors, valid)])
+        candidates = np.unique(np.concatenate(candidates))
+        exact = self.focus(energy, candidates)
+        with np.errstate(invalid='ignore'):
+            best = np.nanmin(np.abs(exact - focus_z))
+        # Anything that could still beat the estimate
+        radius = best + shift if np.isfinite(best) else np.inf
+        window = [candidates]
+        for row in rows:
+            focus = self.sorted_focus[row, :self.valid[row]]
+            start = np.searchsorted(focus, focus_z - radius, side='left')
+            stop = np.searchsorted(focus, focus_z + radius, side='right')
+            window.append(self.order[row, start:stop])
+        candidates = np.unique(np.concatenate(window))
+        exact = self.focus(energy, candidates)
+        best = candidates[np.nanargmin(np.abs(exact - focus_z))]
+        return self.combination(best, energy)
+
+    def combination(self, row, energy):
+        """Describe a row of the combination table at an energy"""
+        mask = self.combo_masks[row]
+        return Combination(self.prefocus_names[self.combo_prefocus[row]],
+                           tuple(int(i) for i in np.flatnonzero(mask[1:])),
+                           float(self.focus(energy, [row])[0]))
@@ -0,0 +1,302 @@
+"""
+Streaming Jungfrau pedestal computation
+
+Frames are folded into running per-pixel statistics as they arrive, one gain
+mode at a time, using a vectorized form of Welford's algorithm that merges a
+whole batch of frames at once. The statistics live in memory-mapped ``.npy``
+files, so memory use does not grow with the number of frames and the
+pedestals are on disk as soon as the last frame has been added. A batch is
+reduced one frame at a time into a few frame sized buffers, so it is never
+converted to floating point as a whole. For a Jungfrau 4M that is 32 MB a
+frame, rather than 3.3 GB for a batch of 100.
+
+Example
+-------
+.. code::
+
+    acc = PedestalAccumulator((8, 512, 1024), 'pedestals/')
+    for gain, run in enumerate(runs):
+        acc.consume(gain, psana_frames(exp, run, 'jungfrau4M'))
+    pedestals, noise, mask = acc.finalize()
+"""
+import os
+import time
+import logging
+import argparse
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#: Bits of a raw Jungfrau sample holding the ADC value
+ADC_MASK = 0x3fff
+
+#: Default number of frames read at a time
+BATCH = 10
+
+#: Bits set in the bad pixel mask
+DEAD = 1
+NOISY = 2
+OUTLIER = 4
+
+
+def iter_frames(source, batch=BATCH):
+    """
+    Yield batches of frames from an array, ``.npy`` file or iterator
+
+    Parameters
+    ----------
+    source : np.ndarray, str or iterable
+        A stack of frames, the path of a ``.npy`` stack that is memory-mapped
+        rather than read, or any iterable of single frames
+
+    batch : int, optional
+        Number of frames per batch
+    """
+    if isinstance(source, str):
+        source = np.load(source, mmap_mode='r')
+    if isinstance(source, np.ndarray):
+        for start in range(0, len(source), batch):
+            yield source[start:start + batch]
+        return
+    frames = list()
+    for frame in source:
+        if frame is None:
+            continue
+        frames.append(frame)
+        if len(frames) == batch:
+            yield np.stack(frames)
+            frames = list()
+    if frames:
+        yield np.stack(frames)
+
+
+def psana_frames(exp, run, detector):
+    """
+    Raw frames of a detector from a psana run
+
+    ``exp`` may also be a shared memory data source string such as
+    ``'shmem=psana.0:stop=no'`` to consume frames while the run is taken
+    """
+    import psana
+    if '=' in exp:
+        ds = psana.DataSource(exp)
+    else:
+        ds = psana.DataSource('exp={}:run={}:smd'.format(exp, run))
+    det = psana.Detector(detector)
+    for evt in ds.events():
+        yield det.raw(evt)
+
+
+class PedestalAccumulator:
+    """
+    Per pixel mean and variance of dark frames for each gain mode
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of a single frame
+
+    output : str
+        Directory for the memory-mapped ``mean.npy``, ``m2.npy``,
+        ``count.npy`` and, once finalized, ``noise.npy`` and ``mask.npy``
+
+    ngains : int, optional
+        Number of gain modes
+
+    adc_mask : int, optional
+        Mask applied to raw samples to strip the gain bits. Pass ``None`` for
+        data that has already been converted
+    """
+    def __init__(self, shape, output, ngains=3, adc_mask=ADC_MASK):
+        self.shape = tuple(shape)
+        self.output = output
+        self.ngains = ngains
+        self.adc_mask = adc_mask
+        os.makedirs(output, exist_ok=True)
+        full = (ngains,) + self.shape
+        self.mean = self._open('mean', full, np.float64)
+        self.m2 = self._open('m2', full, np.float64)
+        self.count = self._open('count', (ngains,), np.int64)
+
+    def _open(self, name, shape, dtype):
+        path = os.path.join(self.output, name + '.npy')
+        array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                          shape=shape)
+        array[:] = 0
+        return array
+
+    def update(self, gain, frames):
+        """
+        Merge a batch of frames into the statistics of one gain mode
+
+        Parameters
+        ----------
+        gain : int
+            Index of the gain mode
+
+        frames : np.ndarray
+            A single frame or a stack of frames
+        """
+        frames = np.asarray(frames)
+        if frames.shape == self.shape:
+            frames = frames[np.newaxis]
+        if frames.shape[1:] != self.shape:
+            raise ValueError("Frames of shape {} do not match {}"
+                             "".format(frames.shape[1:], self.shape))
+        n_b = len(frames)
+        if not n_b:
+            return
+        # Two passes over the frames, never holding more than one of them
+        # as floating point
+        mean_b = np.zeros(self.shape, dtype=np.float64)
+        for frame in frames:
+            mean_b += self._adc(frame)
+        mean_b /= n_b
+        m2_b = np.zeros(self.shape, dtype=np.float64)
+        diff = np.empty(self.shape, dtype=np.float64)
+        for frame in frames:
+            np.subtract(self._adc(frame), mean_b, out=diff)
+            np.multiply(diff, diff, out=diff)
+            m2_b += diff
+        n_a = int(self.count[gain])
+        n = n_a + n_b
+        # Chan et al. merge of two sets of running statistics
+        delta = mean_b - self.mean[gain]
+        self.mean[gain] += delta * (n_b / n)
+        self.m2[gain] += m2_b + delta**2 * (n_a * n_b / n)
+        self.count[gain] = n
+
+    def _adc(self, frame):
+        """ADC values of a single raw frame"""
+        if self.adc_mask is not None:
+            return frame & self.adc_mask
+        return frame
+
+    def consume(self, gain, source, batch=BATCH):
+        """
+        Add every frame from ``source`` to a gain mode
+
+        See ``iter_frames`` for the accepted sources
+
+        Returns
+        -------
+        nframes : int
+        """
+        start = int(self.count[gain])
+        for frames in iter_frames(source, batch=batch):
+            self.update(gain, frames)
+        nframes = int(self.count[gain]) - start
+        logger.info("Added %s frames to gain mode %s", nframes, gain)
+        return nframes
+
+    def noise(self):
+        """Per pixel standard deviation of each gain mode"""
+        count = np.maximum(self.count - 1, 1).astype(np.float64)
+        count = count.reshape((self.ngains,) + (1,) * len(self.shape))
+        return np.sqrt(self.m2 / count)
+
+    def finalize(self, nsigma=5.):
+        """
+        Write the noise and bad pixel mask and return the results
+
+        A pixel is flagged ``DEAD`` if it never changes, ``NOISY`` if its
+        noise is more than ``nsigma`` robust deviations above the median and
+        ``OUTLIER`` if its pedestal is more than ``nsigma`` robust deviations
+        from the median, in any gain mode
+
+        Returns
+        -------
+        pedestals, noise, mask : np.ndarray
+        """
+        noise = self.noise()
+        mask = np.zeros(self.shape, dtype=np.uint8)
+        for gain in range(self.ngains):
+            if not self.count[gain]:
+                continue
+            mask[noise[gain] == 0] |= DEAD
+            mask[self._outliers(noise[gain], nsigma, upper=True)] |= NOISY
+            mask[self._outliers(self.mean[gain], nsigma)] |= OUTLIER
+        self.mean.flush()
+        np.save(os.path.join(self.output, 'noise.npy'), noise)
+        np.save(os.path.join(self.output, 'mask.npy'), mask)
+        return self.mean, noise, mask
+
+    @staticmethod
+    def _outliers(values, nsigma, upper=False):
+        median = np.median(values)
+        mad = 1.4826 * np.median(np.abs(values - median))
+        if not mad:
+            return np.zeros(values.shape, dtype=bool)
+        deviation = (values - median) / mad
+        if upper:
+            return deviation > nsigma
+        return np.abs(deviation) > nsigma
+
+
+def benchmark(shape=(8, 512, 1024), nframes=200, batch=BATCH, output=None):
+    """
+    Time the accumulator on synthetic dark frames
+
+    Every one of the ``nframes`` frames is processed, the last batch being
+    short if ``nframes`` is not a multiple of ``batch``
+
+    Returns
+    -------
+    rate : float
+        Frames processed per second
+    """
+    import tempfile
+    if nframes < 1:
+        raise ValueError("At least one frame is needed for a benchmark")
+    output = output or tempfile.mkdtemp(prefix='pedestal_bench')
+    rng = np.random.default_rng(0)
+    acc = PedestalAccumulator(shape, output, ngains=1)
+    frames = rng.normal(1500, 10, size=(min(batch, nframes),) + tuple(shape))
+    frames = frames.astype(np.uint16)
+    start = time.perf_counter()
+    for first in range(0, nframes, len(frames)):
+        acc.update(0, frames[:nframes - first])
+    acc.finalize()
+    elapsed = time.perf_counter() - start
+    processed = int(acc.count[0])
+    rate = processed / elapsed
+    logger.info("%s frames of %s in %.2f s, %.1f frames/s",
+                processed, shape, elapsed, rate)
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Jungfrau pedestals')
+    sub = parser.add_subparsers(dest='command')
+    bench = sub.add_parser('bench', help='Benchmark on synthetic frames')
+    bench.add_argument('--frames', type=int, default=200)
+    bench.add_argument('--batch', type=int, default=BATCH)
+    runs = sub.add_parser('runs', help='Pedestals from one run per gain')
+    runs.add_argument('exp')
+    runs.add_argument('detector')
+    runs.add_argument('runs', nargs='+', type=int)
+    runs.add_argument('--out', default='pedestals')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'bench':
+        rate = benchmark(nframes=args.frames, batch=args.batch)
+        print('{:.1f} frames/s'.format(rate))
+    elif args.command == 'runs':
+        acc = None
+        for gain, run in enumerate(args.runs):
+            frames = iter_frames(psana_frames(args.exp, run, args.detector))
+            for batch in frames:
+                if acc is None:
+                    acc = PedestalAccumulator(batch.shape[1:], args.out,
+                                              ngains=len(args.runs))
+                acc.update(gain, batch)
+        if acc is not None:
+            acc.finalize()
+            print('Pedestals written to {}'.format(args.out))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Message level profiling of the RunEngine
+
+Every command the RunEngine knows is wrapped so that the time spent
+processing each message is recorded against the command and the name of the
+object it targets, e.g. ``('set', 'tfs_trans')`` or ``('wait', None)``.
+Timings are kept in histograms with power of two buckets, so recording a
+message costs two clock reads and a few integer operations however long the
+plan runs. Time between messages, spent in the plan itself or waiting on a
+suspender, is recorded as ``('plan', None)`` or ``('suspended', None)``.
+Timings are grouped by the ``plan_name`` of the run they belong to.
+
+Example
+-------
+.. code::
+
+    from mfx.profiling import MessageProfiler
+    profiler = MessageProfiler()
+    profiler.attach(RE)
+    RE(tfs_scan(0, 10))
+    profiler.report()
+"""
+import math
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+#: Smallest bucket edge in seconds
+RESOLUTION = 1e-6
+#: Number of histogram buckets, the last one holding everything longer
+NBUCKETS = 32
+
+
+class Timing:
+    """
+    Count, total and log2 histogram of the durations of one kind of message
+
+    Bucket ``i`` holds durations below ``RESOLUTION * 2**i``
+    """
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.buckets = [0] * NBUCKETS
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        bucket = math.frexp(duration / RESOLUTION)[1]
+        self.buckets[min(max(bucket, 0), NBUCKETS - 1)] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def quantile(self, q):
+        """Upper edge of the bucket holding the ``q`` quantile"""
+        if not self.count:
+            return 0.
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return min(RESOLUTION * 2**i, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.mean,
+                'max': self.max, 'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99), 'buckets': list(self.buckets)}
+
+
+class MessageProfiler:
+    """
+    Time every message processed by a RunEngine
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Whether messages are recorded. Can be toggled at any time without
+        detaching
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.plans = dict()
+        self._RE = None
+        self._originals = dict()
+        self._token = None
+        self._state_hook = None
+        self._request_suspend = None
+        self._plan = None
+        self._last = None
+        self._suspended = False
+        self._paused = None
+
+    def attach(self, RE):
+        """Wrap every registered command of ``RE``"""
+        if self._RE is not None:
+            raise RuntimeError("Profiler is already attached to a RunEngine")
+        self._RE = RE
+        for name, func in list(RE._command_registry.items()):
+            self._originals[name] = func
+            RE.register_command(name, self._wrap(name, func))
+        self._token = RE.subscribe(self._document)
+        # Chain onto anything already watching the state or suspensions
+        self._state_hook = RE.state_hook
+        RE.state_hook = self._state_changed
+        self._request_suspend = RE.request_suspend
+        RE.request_suspend = self._suspend_requested
+        logger.debug("Profiling %s commands", len(self._originals))
+
+    def detach(self):
+        """Restore the original commands of the RunEngine"""
+        RE = self._RE
+        if RE is None:
+            return
+        for name, func in self._originals.items():
+            RE.register_command(name, func)
+        RE.unsubscribe(self._token)
+        RE.state_hook = self._state_hook
+        RE.request_suspend = self._request_suspend
+        self._originals.clear()
+        self._RE = None
+
+    def reset(self):
+        """Forget every recorded timing"""
+        self.plans = dict()
+
+    def _record(self, command, obj, duration):
+        timings = self.plans.setdefault(self._plan, dict())
+        key = (command, obj)
+        timing = timings.get(key)
+        if timing is None:
+            timing = timings[key] = Timing()
+        timing.add(duration)
+
+    def _wrap(self, name, func):
+        async def timed(msg):
+            if not self.enabled:
+                return await func(msg)
+            start = time.perf_counter()
+            # Time since the last message went to the plan or a suspension
+            if self._last is not None:
+                self._record('suspended' if self._suspended else 'plan',
+                             None, start - self._last)
+                self._suspended = False
+            try:
+                return await func(msg)
+            finally:
+                end = time.perf_counter()
+                self._record(name, getattr(msg.obj, 'name', None),
+                             end - start)
+                self._last = end
+        return timed
+
+    def _document(self, name, doc):
+        if name == 'start':
+            self._plan = doc.get('plan_name', 'unnamed')
+
+    def _state_changed(self, new, old):
+        if new == 'paused':
+            self._paused = time.perf_counter()
+        elif old == 'paused' and self._paused is not None:
+            self._record('paused', None, time.perf_counter() - self._paused)
+            self._paused = None
+        if new == 'idle':
+            self._plan = None
+            self._last = None
+        if self._state_hook is not None:
+            self._state_hook(new, old)
+
+    def _suspend_requested(self, *args, **kwargs):
+        self._suspended = True
+        return self._request_suspend(*args, **kwargs)
+
+    def as_dict(self):
+        """Every timing, keyed by plan and then ``command:object``"""
+        return {str(plan): {'{}:{}'.format(*key): timing.as_dict()
+                            for key, timing in timings.items()}
+                for plan, timings in self.plans.items()}
+
+    def hot_spots(self, plan=None, top=10):
+        """
+        Messages of a plan that took the most time in total
+
+        Returns
+        -------
+        hot_spots : list of tuple
+            ``(command, object, Timing)`` sorted by total time
+        """
+        timings = self.plans.get(plan, dict())
+        ranked = sorted(timings.items(), key=lambda item: item[1].total,
+                        reverse=True)
+        return [(command, obj, timing)
+                for (command, obj), timing in ranked[:top]]
+
+    def report(self, top=10):
+        """Print the hot spots of every profiled plan"""
+        for plan, timings in self.plans.items():
+            total = sum(timing.total for timing in timings.values())
+            print('{} ({:.3f} s)'.format(plan or 'outside of a run', total))
+            print('  {:<12} {:<20} {:>7} {:>9} {:>9} {:>9} {:>6}'
+                  ''.format('command', 'object', 'count', 'total',
+                            'p50', 'p99', 'share'))
+            for command, obj, timing in self.hot_spots(plan, top=top):
+                print('  {:<12} {:<20} {:>7} {:>9.4f} {:>9.2e} {:>9.2e} '
+                      '{:>6.1%}'.format(command, str(obj or '-')[:20],
+                                        timing.count, timing.total,
+                                        timing.quantile(0.5),
+                                        timing.quantile(0.99),
+                                        timing.total / total if total
+                                        else 0.))
+
+
+@contextmanager
+def profile(RE, report=True, top=10):
+    """
+    Profile everything ``RE`` runs within the block
+
+    Example
+    -------
+    .. code::
+
+        with profile(RE) as profiler:
+            RE(grid_scan(0, 1, 5, 0, 1, 3))
+    """
+    profiler = MessageProfiler()
+    profiler.attach(RE)
+    try:
+        yield profiler
+    finally:
+        profiler.detach()
+        if report:
+            profiler.report(top=top)
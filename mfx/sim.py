@@ -0,0 +1,445 @@
+"""
+Simulated MFX control system
+
+Stand-ins for the shutters, EVR triggers, sequencer, gas detector, injector
+motors, DAQ and ELog that the MFX code talks to, built from plain ophyd
+signals with configurable latencies. ``install`` puts simulated ``mfx.db``
+and ``mfx.beamline`` modules in place so the plans and experiment files can
+be imported without any PVs, and ``patch_ls1016`` swaps the devices that
+module creates at import for simulated ones.
+
+Example
+-------
+.. code::
+
+    from mfx import sim
+    control = sim.install()
+    from experiments import ls1016
+    sim.patch_ls1016(ls1016, control)
+    ls1016.User().loop(delays=[1e5, 2e5], light_events=120, rate='30Hz')
+"""
+import sys
+import time
+import types
+import logging
+import threading
+
+import numpy as np
+
+from ophyd import Device, Component as C
+from ophyd.signal import Signal
+from ophyd.sim import SynAxis
+from ophyd.status import Status
+
+from .devices import LaserShutter, ShutterGroup, ShutterState
+
+logger = logging.getLogger(__name__)
+
+
+def _finish_later(status, delay):
+    """Mark ``status`` done after ``delay`` seconds"""
+    if delay <= 0:
+        status._finished(success=True)
+        return status
+    timer = threading.Timer(delay, status._finished, kwargs={'success': True})
+    timer.daemon = True
+    timer.start()
+    return status
+
+
+class LatencySignal(Signal):
+    """
+    Signal whose ``set`` completes after a fixed latency
+
+    The value is updated immediately, as a put to an IOC would be, but the
+    status only finishes once ``latency`` seconds have passed
+    """
+    def __init__(self, *args, latency=0., **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+        self.puts = 0
+
+    def put(self, value, **kwargs):
+        self.puts += 1
+        super().put(value, **kwargs)
+
+    def set(self, value, **kwargs):
+        self.put(value, **kwargs)
+        return _finish_later(Status(self), self.latency)
+
+
+class SimLaserShutter(Device):
+    """Laser shutter with a simulated analog output channel"""
+    voltage = C(LatencySignal, value=0.)
+    state = C(ShutterState, value='IN')
+    # Share the voltage logic of the real shutter
+    out_voltage = LaserShutter.out_voltage
+    in_voltage = LaserShutter.in_voltage
+    barrier_voltage = LaserShutter.barrier_voltage
+    hysteresis = LaserShutter.hysteresis
+    state_from_voltage = LaserShutter.state_from_voltage
+    voltage_for = LaserShutter.voltage_for
+    voltage_check = LaserShutter.voltage_check
+    _voltage_changed = LaserShutter._voltage_changed
+
+    def __init__(self, *args, latency=0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.voltage.latency = latency
+        self.voltage.subscribe(self._voltage_changed)
+
+    def move(self, position, wait=False, timeout=None):
+        state = {1: 'IN', 2: 'OUT'}.get(position, position)
+        status = self.voltage.set(self.voltage_for(state))
+        if wait:
+            status.wait(timeout)
+        return status
+
+
+class SimTrigger(Device):
+    """EVR trigger"""
+    eventcode = C(LatencySignal, value=0)
+    ns_delay = C(LatencySignal, value=0.)
+    polarity = C(LatencySignal, value=0)
+    width = C(LatencySignal, value=0.)
+    enable_cmd = C(LatencySignal, value=0)
+
+    _default_configuration_attrs = ['eventcode', 'ns_delay', 'polarity',
+                                    'width']
+
+    def __init__(self, *args, latency=0.01, **kwargs):
+        super().__init__(*args, **kwargs)
+        for sig in (self.eventcode, self.ns_delay, self.polarity, self.width,
+                    self.enable_cmd):
+            sig.latency = latency
+
+    def enable(self):
+        self.enable_cmd.put(1)
+
+    def disable(self):
+        self.enable_cmd.put(0)
+
+
+class SimEventStep(Device):
+    """Single step of the event sequencer"""
+    eventcode = C(LatencySignal, value=0)
+    delta_beam = C(LatencySignal, value=0)
+    fiducial = C(LatencySignal, value=0)
+    comment = C(LatencySignal, value='')
+
+    _default_configuration_attrs = ['eventcode', 'delta_beam', 'fiducial',
+                                    'comment']
+
+    def __init__(self, *args, latency=0.01, **kwargs):
+        super().__init__(*args, **kwargs)
+        for sig in (self.eventcode, self.delta_beam, self.fiducial,
+                    self.comment):
+            sig.latency = latency
+
+    def clear(self):
+        self.configure({'eventcode': 0, 'delta_beam': 0, 'fiducial': 0,
+                        'comment': ''})
+
+
+class SimSequencer(Device):
+    """
+    Event sequencer that plays for a fixed time
+
+    ``start`` and ``stop`` follow the pcdsdevices sequencer used by ls1016,
+    ``set`` returns a status that finishes once a play is complete like the
+    ls5016 sequencer
+    """
+    play_control = C(Signal, value=0)
+    play_status = C(Signal, value=0)
+    sync_marker = C(Signal, value='10Hz')
+    sequence_length = C(Signal, value=0)
+
+    _default_read_attrs = ['play_status']
+    _default_configuration_attrs = ['play_control']
+
+    def __init__(self, *args, start_latency=0.005, play_time=0.01, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.start_latency = start_latency
+        self.play_time = play_time
+        self.play_count = 0
+
+    def _play(self, forever=False):
+        time.sleep(self.start_latency)
+        self.play_status.put(2)
+        if forever:
+            return
+        time.sleep(self.play_time)
+        self.play_count += 1
+        self.play_status.put(0)
+
+    def start(self):
+        self.play_control.put(1)
+        threading.Thread(target=self._play, kwargs={'forever': True},
+                         daemon=True).start()
+
+    def stop(self, wait=False, timeout=None, success=False):
+        self.play_control.put(0)
+        self.play_status.put(0)
+        return Status(self, done=True, success=True)
+
+    def set(self, *args, wait=False, timeout=None):
+        status = Status(self, timeout=timeout)
+
+        def play():
+            self._play()
+            status._finished(success=True)
+
+        self.play_control.put(1)
+        threading.Thread(target=play, daemon=True).start()
+        if wait:
+            status.wait(timeout)
+        return status
+
+
+class SimGasDetector(Signal):
+    """
+    Gas detector energy published at a fixed rate
+
+    Parameters
+    ----------
+    rate : float, optional
+        Updates per second
+
+    mean, noise : float, optional
+        Normal distribution of the simulated pulse energy
+    """
+    def __init__(self, *args, rate=120., mean=1., noise=0.05, **kwargs):
+        kwargs.setdefault('value', mean)
+        super().__init__(*args, **kwargs)
+        self.rate = rate
+        self.mean = mean
+        self.noise = noise
+        self._rng = np.random.default_rng()
+        self._running = False
+        self._thread = None
+
+    def sample(self):
+        """Publish a single new pulse energy"""
+        self.put(float(self._rng.normal(self.mean, self.noise)))
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        period = 1. / self.rate
+        while self._running:
+            self.sample()
+            time.sleep(period)
+
+
+class SimMotor(SynAxis):
+    """Synthetic motor whose moves take distance over velocity"""
+    velocity = C(Signal, value=1.)
+
+    def __init__(self, *args, settle_time=0., **kwargs):
+        super().__init__(*args, **kwargs)
+        self.settle = settle_time
+
+    def set(self, value):
+        distance = abs(value - self.readback.get())
+        self.delay = distance / max(self.velocity.get(), 1e-9) + self.settle
+        return super().set(value)
+
+
+class SimDaq:
+    """
+    DAQ that takes events at a fixed rate
+
+    Follows the parts of the pcdsdevices ``Daq`` used by the experiments
+    """
+    def __init__(self, rate=120., configure_latency=0.05,
+                 begin_latency=0.05, end_latency=0.05):
+        self.rate = rate
+        self.configure_latency = configure_latency
+        self.begin_latency = begin_latency
+        self.end_latency = end_latency
+        self.configured = False
+        self.state = 'Disconnected'
+        self.events = None
+        self.duration = None
+        self.record = False
+        self.run = 0
+        #: Number of times the DAQ was configured
+        self.configures = 0
+        self._done = threading.Event()
+        self._done.set()
+
+    def runnumber(self):
+        return self.run
+
+    def connect(self):
+        self.state = 'Connected'
+
+    def disconnect(self):
+        self.configured = False
+        self.state = 'Disconnected'
+
+    def configure(self, events=None, duration=None, record=None, **kwargs):
+        # Every configuration pays the full cost, as the real DAQ may
+        time.sleep(self.configure_latency)
+        self.configures += 1
+        self.events = events
+        self.duration = duration
+        if record is not None:
+            self.record = record
+        self.configured = True
+        self.state = 'Configured'
+
+    def kickoff(self, events=None, duration=None, **kwargs):
+        """Start a run, the status finishes once the DAQ is running"""
+        if not self.configured:
+            self.configure()
+        if events is not None or duration is not None:
+            self.events = events
+            self.duration = duration
+        self.run += 1
+        self._done.clear()
+        status = Status(self)
+        if self.duration:
+            length = self.duration
+        else:
+            length = (self.events or 0) / self.rate
+
+        def take():
+            time.sleep(self.begin_latency)
+            self.state = 'Running'
+            status._finished(success=True)
+            time.sleep(length)
+            self._done.set()
+
+        threading.Thread(target=take, daemon=True).start()
+        return status
+
+    def complete(self):
+        """Status finished once every event of the run has been taken"""
+        status = Status(self)
+
+        def watch():
+            self._done.wait()
+            status._finished(success=True)
+
+        threading.Thread(target=watch, daemon=True).start()
+        return status
+
+    def begin(self, events=None, duration=None, record=None, wait=False,
+              **kwargs):
+        if not self.configured or (record is not None
+                                   and record != self.record):
+            self.configure(record=record)
+        self.kickoff(events=events, duration=duration).wait()
+        if wait:
+            self.wait()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout=timeout)
+
+    def end_run(self):
+        self.wait()
+        time.sleep(self.end_latency)
+        self.state = 'Open'
+
+
+class SimElog:
+    """ELog that keeps its posts"""
+    def __init__(self, latency=0.1):
+        self.latency = latency
+        self.posts = list()
+
+    def post(self, msg, **kwargs):
+        time.sleep(self.latency)
+        self.posts.append((msg, kwargs))
+
+
+class SimControlSystem:
+    """
+    Every simulated device, with shared latency settings
+
+    Parameters
+    ----------
+    latency : float, optional
+        Latency of configuration writes
+    """
+    def __init__(self, latency=0.01, shutter_latency=0.05, daq_rate=120.,
+                 motor_velocity=1.):
+        self.shutters = [SimLaserShutter(name=name, latency=shutter_latency)
+                         for name in ('evo_shutter1', 'evo_shutter2',
+                                      'evo_shutter3', 'opo_shutter')]
+        self.evo = SimTrigger(name='evo_trigger', latency=latency)
+        self.pacemaker = SimTrigger(name='pacemaker_trigger', latency=latency)
+        self.inhibit = SimTrigger(name='inhibit_trigger', latency=latency)
+        self.inhibit.eventcode.put(198)
+        self.seq_steps = [SimEventStep(name='step_{}'.format(i),
+                                       latency=latency)
+                          for i in range(20)]
+        self.sequencer = SimSequencer(name='mfx_sequencer')
+        self.gdet = SimGasDetector(name='GDET:FEE1:241:ENRC')
+        self.inj_x = SimMotor(name='inj_x')
+        self.inj_y = SimMotor(name='inj_y')
+        self.tfs_trans = SimMotor(name='tfs_trans')
+        for motor in (self.inj_x, self.inj_y, self.tfs_trans):
+            motor.velocity.put(motor_velocity)
+        self.daq = SimDaq(rate=daq_rate)
+        self.elog = SimElog()
+
+
+def install(control=None):
+    """
+    Put simulated ``mfx.db`` and ``mfx.beamline`` modules in place
+
+    Must be called before importing the plans or experiment files
+
+    The simulated ``mfx.beamline`` only holds ``tfs_trans`` for
+    ``mfx.plans``. The real ``mfx.beamline`` does not define it, so
+    ``mfx.plans`` does not import in a live session
+
+    Returns
+    -------
+    control : SimControlSystem
+    """
+    control = control or SimControlSystem()
+    db = types.ModuleType('mfx.db')
+    db.daq = control.daq
+    db.elog = control.elog
+    db.inj_x = control.inj_x
+    db.inj_y = control.inj_y
+    sys.modules['mfx.db'] = db
+    beamline = types.ModuleType('mfx.beamline')
+    beamline.tfs_trans = control.tfs_trans
+    sys.modules['mfx.beamline'] = beamline
+    return control
+
+
+def patch_ls1016(module, control):
+    """Swap the devices ``experiments.ls1016`` creates for simulated ones"""
+    from .elog import ElogQueue
+    (module.evo_shutter1, module.evo_shutter2,
+     module.evo_shutter3, module.opo_shutter) = control.shutters
+    module.shutters = ShutterGroup(*control.shutters, name='laser_shutters')
+    module.sequencer = control.sequencer
+    module.seq_steps = control.seq_steps
+    module.evo = control.evo
+    module.pacemaker = control.pacemaker
+    module.inhibit = control.inhibit
+    module.daq = control.daq
+    module.elog = control.elog
+    module.elog_queue = ElogQueue(control.elog)
+    module.config_cache.invalidate()
+    for attr in ('opo_shutter', 'evo_shutter1', 'evo_shutter2',
+                 'evo_shutter3', 'sequencer', 'inhibit', 'pacemaker'):
+        setattr(module.User, attr, getattr(module, attr))
+
+
+def patch_ls5016(module, control):
+    """Swap the sequencer ``experiments.ls5016`` creates for a simulated one"""
+    module.seq = control.sequencer
+    module.inj_x = control.inj_x
+    module.inj_y = control.inj_y
@@ -0,0 +1,242 @@
+"""
+Timeline of where session startup spends its time
+
+``mfxpython`` exports ``MFX_LAUNCH_TIME`` before activating the environment.
+The time from then until the Python process started is recorded as the
+``conda activation`` stage, and the time from then until ``mfx`` is imported
+as ``python startup``. ``mfxpython`` starts hutch-python through ``main``,
+which imports ``mfx`` first and records the hutch-python imports and the
+happi database load as stages of their own. Later stages are recorded with
+``timeline.stage``. Import time is counted for each thread, so a stage only
+sees the imports made by the thread that runs it. Set ``MFX_STARTUP_PROFILE``
+to a path to have the timeline written there as JSON once the background warm
+up has finished.
+
+Example
+-------
+.. code::
+
+    from mfx.startup import timeline
+    timeline.report()
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import builtins
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def _process_start():
+    """Wall clock time at which this process started, None if unknown"""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # Fields after the command name, which may hold spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        ticks = int(fields[19])
+        return time.time() - uptime + ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _ImportTimer:
+    """Accumulate the time each thread spends inside top level imports"""
+    def __init__(self):
+        self._elapsed = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._original = None
+        self._users = 0
+
+    def install(self):
+        with self._lock:
+            self._users += 1
+            if self._users > 1:
+                return
+            self._original = builtins.__import__
+            original = self._original
+            local = self._local
+
+            def timed_import(*args, **kwargs):
+                depth = getattr(local, 'depth', 0)
+                local.depth = depth + 1
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    local.depth = depth
+                    if not depth:
+                        ident = threading.get_ident()
+                        self._elapsed[ident] = (self._elapsed.get(ident, 0.)
+                                                + time.perf_counter() - start)
+
+            builtins.__import__ = timed_import
+
+    def uninstall(self):
+        with self._lock:
+            self._users -= 1
+            if not self._users:
+                builtins.__import__ = self._original
+
+    @property
+    def elapsed(self):
+        """Time spent importing by the calling thread"""
+        return self._elapsed.get(threading.get_ident(), 0.)
+
+
+class StartupTimeline:
+    """
+    Wall time, import time and PV connection counts of startup stages
+    """
+    def __init__(self):
+        self.created = time.time()
+        self.stages = list()
+        self.connections = dict()
+        self._imports = _ImportTimer()
+        launch = os.environ.get('MFX_LAUNCH_TIME')
+        if launch:
+            try:
+                launch = float(launch)
+            except ValueError:
+                logger.debug("Ignoring invalid MFX_LAUNCH_TIME %r", launch)
+            else:
+                self._launch_stages(launch)
+
+    def _launch_stages(self, launch):
+        """Stages from the launch of ``mfxpython`` until now"""
+        started = _process_start()
+        if started is None or not launch <= started <= self.created:
+            # Unable to tell the environment and interpreter apart
+            marks = [('launch', launch)]
+        else:
+            marks = [('conda activation', launch),
+                     ('python startup', started)]
+        ends = [start for _, start in marks[1:]] + [self.created]
+        for (name, start), end in zip(marks, ends):
+            self.stages.append({'name': name, 'start': start,
+                                'wall': end - start, 'imports': None,
+                                'modules': None})
+        self.stages[-1]['modules'] = len(sys.modules)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as a stage of startup"""
+        modules = len(sys.modules)
+        self._imports.install()
+        before = self._imports.elapsed
+        start = time.time()
+        try:
+            yield
+        finally:
+            wall = time.time() - start
+            self._imports.uninstall()
+            self.stages.append({'name': name, 'start': start, 'wall': wall,
+                                'imports': self._imports.elapsed - before,
+                                'modules': len(sys.modules) - modules})
+
+    def record_connections(self, name, device):
+        """
+        Count how many of the signals of ``device`` are connected
+
+        Should be called once the device has been given time to connect
+        """
+        connected = total = 0
+        walk = getattr(device, 'walk_signals', None)
+        signals = [walk_item.item for walk_item in walk()] if walk else []
+        for sig in signals:
+            total += 1
+            connected += bool(getattr(sig, 'connected', False))
+        self.connections[name] = {'connected': connected,
+                                  'timed_out': total - connected}
+
+    def as_dict(self):
+        """The timeline as JSON serializable data"""
+        return {'host': socket.gethostname(),
+                'env': os.environ.get('CONDA_ENVNAME'),
+                'created': self.created,
+                'total': time.time() - self.first_start,
+                'stages': list(self.stages),
+                'connections': dict(self.connections)}
+
+    @property
+    def first_start(self):
+        return min([stage['start'] for stage in self.stages]
+                   + [self.created])
+
+    def dump(self, path):
+        """Write the timeline to ``path`` as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def report(self):
+        """Print the timeline"""
+        origin = self.first_start
+        print('{:<30} {:>8} {:>8} {:>8} {:>8}'.format('Stage', 'Start',
+                                                      'Wall', 'Import',
+                                                      'Modules'))
+        for stage in self.stages:
+            imports = stage['imports']
+            print('{:<30} {:>8.2f} {:>8.2f} {:>8} {:>8}'.format(
+                        stage['name'], stage['start'] - origin,
+                        stage['wall'],
+                        '-' if imports is None else '{:.2f}'.format(imports),
+                        '-' if stage['modules'] is None else stage['modules']))
+        if self.connections:
+            print()
+            print('{:<30} {:>10} {:>10}'.format('Device', 'Connected',
+                                                'Timed out'))
+            for name, counts in sorted(self.connections.items()):
+                print('{:<30} {connected:>10} {timed_out:>10}'
+                      ''.format(name, **counts))
+
+    def finish(self):
+        """Write the timeline if ``MFX_STARTUP_PROFILE`` is set"""
+        path = os.environ.get('MFX_STARTUP_PROFILE')
+        if path:
+            try:
+                self.dump(path)
+            except OSError:
+                logger.exception("Unable to write startup profile")
+
+
+timeline = StartupTimeline()
+
+
+def _staged(name, func):
+    """Record every call of ``func`` as a stage of the timeline"""
+    def wrapped(*args, **kwargs):
+        with timeline.stage(name):
+            return func(*args, **kwargs)
+    return wrapped
+
+
+def main():
+    """
+    Run hutch-python, recording its imports and happi load as stages
+
+    Used by ``mfxpython`` in place of the ``hutch-python`` script, with the
+    same arguments
+    """
+    with timeline.stage('hutch-python imports'):
+        from hutch_python import cli, load_conf
+    # Both read the whole happi database
+    for func, name in (('get_lightpath', 'happi lightpath'),
+                       ('get_happi_objs', 'happi devices')):
+        if hasattr(load_conf, func):
+            setattr(load_conf, func, _staged(name, getattr(load_conf, func)))
+    sys.argv[0] = 'hutch-python'
+    sys.exit(cli.main())
+
+
+if __name__ == '__main__':
+    # Record into the timeline of the mfx.startup module used by mfx.lazy,
+    # rather than the one of this __main__ module
+    from mfx.startup import main as _main
+    _main()
@@ -0,0 +1,145 @@
+"""
+Streaming statistics over a fixed window of samples
+
+Every update is O(1) regardless of the window length, so these can sit behind
+120 Hz monitor callbacks with long averaging windows.
+"""
+import math
+from collections import deque
+
+import numpy as np
+
+
+class RollingStats:
+    """
+    Fixed length ring buffer with running statistics
+
+    The mean and variance are kept as a running sum and a running sum of
+    squared deviations that are updated as each sample replaces the oldest
+    one in the window. The minimum and maximum are tracked with monotonic
+    deques, and an exponentially weighted moving average is kept alongside.
+
+    Parameters
+    ----------
+    size : int
+        Number of samples in the window
+
+    fill : float, optional
+        Initial value of every sample in the window
+
+    alpha : float, optional
+        Smoothing factor for the EWMA. By default this is ``2 / (size + 1)``,
+        which gives the same center of mass as the rolling mean
+    """
+    reducers = ('mean', 'ewma', 'std', 'min', 'max')
+
+    def __init__(self, size, fill=0.0, alpha=None):
+        if size < 1:
+            raise ValueError("Window size must be at least one sample")
+        self.size = int(size)
+        self.alpha = alpha or 2.0 / (self.size + 1)
+        self.reset(fill)
+
+    def reset(self, fill=0.0):
+        """Fill the entire window with a single value"""
+        fill = float(fill)
+        self.values = np.full(self.size, fill)
+        self.index = 0
+        self.count = 0
+        self._sum = fill * self.size
+        self._m2 = 0.0
+        self._ewma = fill
+        # Monotonic deques of (sample number, value). The window starts full
+        # of the fill value, which we record as a single sample that expires
+        # when the first real sample falls out of the window
+        self._min = deque([(-1, fill)])
+        self._max = deque([(-1, fill)])
+
+    def update(self, value):
+        """
+        Add a new sample to the window, dropping the oldest one
+
+        Parameters
+        ----------
+        value : float
+            New sample
+        """
+        value = float(value)
+        old = self.values[self.index]
+        old_mean = self._sum / self.size
+        self._sum += value - old
+        new_mean = self._sum / self.size
+        # Sliding window form of Welford's algorithm
+        self._m2 += (value - old) * (value - new_mean + old - old_mean)
+        self.values[self.index] = value
+        self.index += 1
+        if self.index == self.size:
+            self.index = 0
+            # Resynchronize once per pass of the buffer so that floating point
+            # error can not accumulate. This is amortized O(1) per update
+            self._resync()
+        self._ewma += self.alpha * (value - self._ewma)
+        self._update_extrema(value)
+        self.count += 1
+
+    def _update_extrema(self, value):
+        n = self.count
+        expired = n - self.size
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((n, value))
+        while self._min[0][0] <= expired:
+            self._min.popleft()
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((n, value))
+        while self._max[0][0] <= expired:
+            self._max.popleft()
+
+    def _resync(self):
+        self._sum = float(np.sum(self.values))
+        self._m2 = float(np.sum((self.values - self._sum / self.size)**2))
+
+    @property
+    def mean(self):
+        """Mean of the samples in the window"""
+        return self._sum / self.size
+
+    @property
+    def ewma(self):
+        """Exponentially weighted moving average of all samples"""
+        return self._ewma
+
+    @property
+    def var(self):
+        """Population variance of the samples in the window"""
+        return max(self._m2, 0.0) / self.size
+
+    @property
+    def std(self):
+        """Population standard deviation of the samples in the window"""
+        return math.sqrt(self.var)
+
+    @property
+    def min(self):
+        """Smallest sample in the window"""
+        return self._min[0][1]
+
+    @property
+    def max(self):
+        """Largest sample in the window"""
+        return self._max[0][1]
+
+    def reduce(self, reducer='mean'):
+        """
+        Return a single statistic of the window by name
+
+        Parameters
+        ----------
+        reducer : str, optional
+            One of ``RollingStats.reducers``
+        """
+        if reducer not in self.reducers:
+            raise ValueError("Unknown reducer {!r}, must be one of {}"
+                             "".format(reducer, self.reducers))
+        return getattr(self, reducer)
@@ -1,42 +1,316 @@
+import time
+import logging
 import threading
 
 import numpy as np
 
-from bluesky.suspenders import SuspendFloor
+from bluesky.suspenders import SuspenderBase, SuspendFloor
 from ophyd.signal import Signal, EpicsSignalRO
 
+from .accounting import SuspensionAccountingMixin
+from .averaging import AveragingService
+from .stats import RollingStats
+
+logger = logging.getLogger(__name__)
+
 
 class AvgSignal(Signal):
     """
     Signal that acts as a rolling average of another signal
+
+    Parameters
+    ----------
+    signal : ophyd.Signal
+        Signal to average
+
+    averages : int
+        Number of samples in the window
+
+    reducer : str or callable, optional
+        Statistic to report. Either one of ``RollingStats.reducers`` or a
+        callable that takes the ``RollingStats`` and returns a value, e.g.
+        ``lambda s: s.mean - 2 * s.std`` for a noise-aware floor
+
+    deadband : float, optional
+        Only publish when the average has moved by more than this absolute
+        amount since the last published value
+
+    rel_deadband : float, optional
+        Only publish when the average has moved by more than this fraction of
+        the last published value
+
+    max_rate : float, optional
+        Maximum number of publishes per second. Updates that arrive too soon
+        are coalesced and only the most recent one is published once the
+        interval has passed
+
+    Notes
+    -----
+    With no deadband or rate the signal publishes on every update of the
+    underlying signal. ``raw_updates`` and ``published_updates`` count the
+    incoming updates and the puts actually made
     """
-    def __init__(self, signal, averages, name=None, parent=None, **kwargs):
+    def __init__(self, signal, averages, reducer='mean', deadband=None,
+                 rel_deadband=None, max_rate=None, name=None, parent=None,
+                 **kwargs):
         super().__init__(name=name, parent=parent, **kwargs)
         self.sig = signal
         self.lock = threading.RLock()
-        self.index = 0
-        self.values = np.ones(averages) * self.sig.get()
+        # Publishing policy
+        self.deadband = deadband
+        self.rel_deadband = rel_deadband
+        self.max_rate = max_rate
+        self.raw_updates = 0
+        self.published_updates = 0
+        self._last_published = None
+        self._last_publish_time = 0.0
+        self._pending = None
+        self._timer = None
+        if not callable(reducer) and reducer not in RollingStats.reducers:
+            raise ValueError("Unknown reducer {!r}".format(reducer))
+        self.reducer = reducer
+        self.stats = RollingStats(averages, fill=self.sig.get())
         self.sig.subscribe(self._update_avg)
 
+    @property
+    def values(self):
+        """Samples currently in the window"""
+        return self.stats.values
+
+    def _reduce(self):
+        if callable(self.reducer):
+            return self.reducer(self.stats)
+        return self.stats.reduce(self.reducer)
+
+    def _outside_deadband(self, value):
+        last = self._last_published
+        if last is None:
+            return True
+        if self.deadband is not None and abs(value - last) <= self.deadband:
+            return False
+        if (self.rel_deadband is not None
+                and abs(value - last) <= self.rel_deadband * abs(last)):
+            return False
+        return True
+
+    def _publish(self, value):
+        self._last_published = value
+        self._last_publish_time = time.monotonic()
+        self.published_updates += 1
+        self.put(value)
+
+    def _flush(self):
+        with self.lock:
+            self._timer = None
+            value, self._pending = self._pending, None
+            if value is not None and self._outside_deadband(value):
+                self._publish(value)
+
     def _update_avg(self, *args, value, **kwargs):
         with self.lock:
-            self.values[self.index] = value
-            self.index += 1
-            if self.index == len(self.values):
-                self.index = 0
-            self.put(np.mean(self.values))
+            self.raw_updates += 1
+            self.stats.update(value)
+            avg = self._reduce()
+            if not self._outside_deadband(avg):
+                self._pending = None
+                return
+            if self.max_rate:
+                wait = (self._last_publish_time + 1.0 / self.max_rate
+                        - time.monotonic())
+                if wait > 0:
+                    # Coalesce, the timer publishes the latest value
+                    self._pending = avg
+                    if self._timer is None:
+                        self._timer = threading.Timer(wait, self._flush)
+                        self._timer.daemon = True
+                        self._timer.start()
+                    return
+            self._pending = None
+            self._publish(avg)
 
 
-class BeamEnergySuspendFloor(SuspendFloor):
+class BeamEnergySuspendFloor(SuspensionAccountingMixin, SuspendFloor):
     """
     Suspend the run if the beam energy falls below a set value.
+
+    The ``reducer``, ``deadband``, ``rel_deadband`` and ``max_rate``
+    keywords are passed to ``AvgSignal`` to choose the statistic the
+    threshold is compared against and how often it is published. If an
+    ``AveragingService`` is given as ``service`` the rolling mean is kept
+    there instead, and these keywords can not be used.
+
+    Every suspend and resume is recorded in ``suspension_log``, see
+    ``mfx.accounting.SuspensionLog``.
     """
     def __init__(self, suspend_thresh, resume_thresh=None, sleep=5.0,
-                 averages=120, **kwargs):
-
+                 averages=120, reducer='mean', deadband=None,
+                 rel_deadband=None, max_rate=None, service=None, **kwargs):
+        if service is not None and (reducer != 'mean' or deadband is not None
+                                    or rel_deadband is not None
+                                    or max_rate is not None):
+            raise ValueError("The AveragingService only keeps a rolling "
+                             "mean, reducer, deadband, rel_deadband and "
+                             "max_rate can not be used with a service")
         sig = EpicsSignalRO('GDET:FEE1:241:ENRC')
-        if averages > 1:
-            sig = AvgSignal(sig, averages, name=sig.name + "_avg")
+        if averages > 1 and service is not None:
+            sig = service.add(sig, averages)
+        elif averages > 1:
+            sig = AvgSignal(sig, averages, reducer=reducer,
+                            deadband=deadband, rel_deadband=rel_deadband,
+                            max_rate=max_rate, name=sig.name + "_avg")
 
         super().__init__(sig, suspend_thresh, resume_thresh=resume_thresh,
                          sleep=sleep, **kwargs)
+
+
+class CompositeBeamSuspender(SuspensionAccountingMixin, SuspenderBase):
+    """
+    Suspend the run if any of several beam conditions is violated
+
+    Monitor callbacks only record the newest value of each signal. A single
+    worker thread then checks every condition at once and updates one
+    internal signal that holds the number of tripped conditions. The
+    RunEngine sees one suspend when the first condition trips and one resume
+    once all of them have cleared.
+
+    Parameters
+    ----------
+    conditions : list of dict
+        One entry per signal with the keys:
+
+        ``signal``
+            The ``ophyd.Signal`` to watch
+        ``suspend_thresh``
+            Value at which the condition trips
+        ``resume_thresh``, optional
+            Value at which the condition clears. Defaults to
+            ``suspend_thresh``
+        ``kind``, optional
+            ``'floor'`` (default) trips below the threshold, ``'ceil'``
+            trips above it
+        ``averages``, optional
+            Number of samples to average before comparing. Defaults to 1
+        ``name``, optional
+            Label used when reporting the tripped condition. Defaults to
+            the signal name
+
+    sleep : float, optional
+        Time to wait after all conditions clear before resuming
+
+    service : AveragingService, optional
+        Service used for averaged conditions. One is created if needed
+
+    suspension_log : SuspensionLog, optional
+        Log of every suspend and resume. The value of the first tripped
+        condition is recorded as the trip value
+
+    Example
+    -------
+    .. code::
+
+        suspender = CompositeBeamSuspender([
+            {'signal': EpicsSignalRO('GDET:FEE1:241:ENRC'),
+             'suspend_thresh': 0.6, 'resume_thresh': 0.8, 'averages': 120},
+            {'signal': EpicsSignalRO('GDET:FEE1:242:ENRC'),
+             'suspend_thresh': 0.6, 'averages': 120}])
+        RE.install_suspender(suspender)
+    """
+    def __init__(self, conditions, sleep=5.0, service=None,
+                 name='composite_beam_suspender', **kwargs):
+        self.conditions = list()
+        n = len(conditions)
+        self.values = np.zeros(n)
+        self.suspend_thresh = np.zeros(n)
+        self.resume_thresh = np.zeros(n)
+        self.sign = np.ones(n)
+        self.tripped_mask = np.zeros(n, dtype=bool)
+        self._wake = threading.Event()
+        for i, cond in enumerate(conditions):
+            cond = dict(cond)
+            sig = cond['signal']
+            kind = cond.get('kind', 'floor')
+            if kind not in ('floor', 'ceil'):
+                raise ValueError("Condition kind must be 'floor' or 'ceil'")
+            suspend = cond['suspend_thresh']
+            resume = cond.get('resume_thresh')
+            if resume is None:
+                resume = suspend
+            if (kind == 'floor' and resume < suspend
+                    or kind == 'ceil' and resume > suspend):
+                raise ValueError("Resume threshold {} must be on the safe "
+                                 "side of the suspend threshold {} for {!r}"
+                                 "".format(resume, suspend, sig.name))
+            averages = cond.get('averages', 1)
+            if averages > 1:
+                if service is None:
+                    service = AveragingService()
+                sig = service.add(sig, averages)
+            cond.setdefault('name', sig.name)
+            cond['source'] = sig
+            self.conditions.append(cond)
+            self.suspend_thresh[i] = suspend
+            self.resume_thresh[i] = resume
+            self.sign[i] = 1 if kind == 'floor' else -1
+            self.values[i] = sig.get()
+            sig.subscribe(self._make_callback(i), run=False)
+        self.service = service
+        self.state = Signal(name=name + '_tripped', value=0)
+        super().__init__(self.state, sleep=sleep, **kwargs)
+        self.evaluate()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=name)
+        self._thread.start()
+
+    def _make_callback(self, index):
+        def update(*args, value, **kwargs):
+            self.values[index] = value
+            self._wake.set()
+        return update
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.evaluate()
+            except Exception:
+                logger.exception("Failed to evaluate beam conditions")
+
+    def evaluate(self):
+        """
+        Check every condition against its latest value
+
+        Tripped conditions must reach their resume threshold to clear, all
+        others trip at their suspend threshold.
+        """
+        scaled = self.sign * self.values
+        self.tripped_mask = np.where(self.tripped_mask,
+                                     scaled < self.sign * self.resume_thresh,
+                                     scaled < self.sign * self.suspend_thresh)
+        count = int(np.count_nonzero(self.tripped_mask))
+        if count != self.state.get():
+            self.state.put(count)
+
+    @property
+    def tripped_conditions(self):
+        """Names and values of the conditions currently tripped"""
+        return [(self.conditions[i]['name'], self.values[i])
+                for i in np.flatnonzero(self.tripped_mask)]
+
+    def _trip_value(self, value):
+        tripped = self.tripped_conditions
+        return float(tripped[0][1]) if tripped else None
+
+    def _should_suspend(self, value):
+        return value > 0
+
+    def _should_resume(self, value):
+        return value == 0
+
+    def _get_justification(self):
+        if not self.tripped:
+            return ''
+        tripped = ', '.join('{} = {}'.format(name, value)
+                            for name, value in self.tripped_conditions)
+        return ('Suspender of type {} stopped by {}'
+                ''.format(self.__class__.__name__, tripped))
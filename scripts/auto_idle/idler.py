@@ -1,14 +1,153 @@
+"""
+Idle detectors when the hutch door is opened
+
+Instead of polling with ``caget`` every PV in the rules is monitored, and the
+rules are checked as soon as any of them changes. A rule only fires once its
+condition has held for ``debounce`` seconds, and never more than once every
+``holdoff`` seconds, so the detector is not repeatedly idled while the door
+stays open.
+
+Rules are a list of dictionaries, either the default ``RULES`` below or a
+JSON file passed with ``--rules``:
+
+``name``
+    Label used in the log
+``door``
+    Door PV, the rule applies while it reads ``door_open``
+``door_open``, optional
+    Value of the door PV when open. Defaults to 0
+``voltage``, optional
+    Detector HV PV, the detector is only idled while above ``min_voltage``
+``min_voltage``, optional
+    Defaults to 30
+``action``
+    PV to write ``action_value`` (default 1) to, e.g. ``IDLE.PROC``
+``debounce``, optional
+    Seconds the condition must hold before acting. Defaults to 0.1
+``holdoff``, optional
+    Minimum seconds between two actions. Defaults to 5
+
+The PV prefix of every name can be swapped with ``--prefix`` to run against
+a simulated IOC, e.g. one built with ``caproto``.
+"""
+import json
 import time
-from psp.caget import caget
-from psp.caput import caput
+import logging
+import argparse
+import threading
+
+from epics import PV
 
-# Updated to check that Detector is ON before idling.  
+logger = logging.getLogger(__name__)
+
+# Updated to check that Detector is ON before idling.
 # Avoid turning on detector if is off and also avoid repeatedly idling
 # when already set to idle.
-while True:
-    door_state = caget('PPS:FEH1:45:DOORA')
-    if door_state == 0 and caget('DET:MBL:MPD:CH:200:GetVoltageMeasurement') > 30:
-        print("Attempting to idle detector ...")
-        caput('DET:CSPAD:DETECTOR:IDLE.PROC', 1)
-        time.sleep(5)
-    time.sleep(1)
+RULES = [{'name': 'CSPAD',
+          'door': 'PPS:FEH1:45:DOORA',
+          'door_open': 0,
+          'voltage': 'DET:MBL:MPD:CH:200:GetVoltageMeasurement',
+          'min_voltage': 30,
+          'action': 'DET:CSPAD:DETECTOR:IDLE.PROC',
+          'debounce': 0.1,
+          'holdoff': 5.0}]
+
+
+class Rule:
+    """
+    Monitor a door and detector voltage and idle the detector
+
+    Parameters
+    ----------
+    config : dict
+        A single entry of the rule table
+
+    prefix : str, optional
+        Prepended to every PV name
+    """
+    def __init__(self, config, prefix=''):
+        self.name = config['name']
+        self.door_open = config.get('door_open', 0)
+        self.min_voltage = config.get('min_voltage', 30)
+        self.action_value = config.get('action_value', 1)
+        self.debounce = config.get('debounce', 0.1)
+        self.holdoff = config.get('holdoff', 5.0)
+        self.last_action = None
+        self.actions = 0
+        self._lock = threading.Lock()
+        self._timer = None
+        # Callbacks may fire before the PVs below are assigned
+        self.voltage_pv = config.get('voltage')
+        self.door = None
+        self.voltage = None
+        self.action = PV(prefix + config['action'])
+        self.door = PV(prefix + config['door'],
+                       callback=self._changed, auto_monitor=True)
+        if self.voltage_pv:
+            self.voltage = PV(prefix + self.voltage_pv,
+                              callback=self._changed, auto_monitor=True)
+
+    def condition(self):
+        """Whether the detector should be idled right now"""
+        if (self.door is None or not self.door.connected
+                or self.door.value != self.door_open):
+            return False
+        if self.voltage_pv:
+            return (self.voltage is not None and self.voltage.connected
+                    and self.voltage.value is not None
+                    and self.voltage.value > self.min_voltage)
+        return True
+
+    def _changed(self, **kwargs):
+        with self._lock:
+            if self._timer is not None or not self.condition():
+                return
+            # Wait out the debounce before acting, and at least until the
+            # holdoff from the last action has passed
+            delay = self.debounce
+            if self.last_action is not None:
+                delay = max(delay, self.last_action + self.holdoff
+                            - time.monotonic())
+            self._timer = threading.Timer(delay, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        with self._lock:
+            self._timer = None
+            if not self.condition():
+                logger.debug("%s: condition cleared during debounce",
+                             self.name)
+                return
+            logger.info("%s: attempting to idle detector ...", self.name)
+            self.action.put(self.action_value)
+            self.last_action = time.monotonic()
+            self.actions += 1
+        # The detector may still be on after the holdoff, check again
+        timer = threading.Timer(self.holdoff, self._changed)
+        timer.daemon = True
+        timer.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rules', help='JSON file with the rule table')
+    parser.add_argument('--prefix', default='',
+                        help='Prefix added to every PV name')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(message)s')
+    rules = RULES
+    if args.rules:
+        with open(args.rules, 'r') as f:
+            rules = json.load(f)
+    rules = [Rule(config, prefix=args.prefix) for config in rules]
+    logger.info("Watching %s", ', '.join(rule.name for rule in rules))
+    # Everything happens in the monitor callbacks
+    while True:
+        time.sleep(60)
+
+
+if __name__ == '__main__':
+    main()
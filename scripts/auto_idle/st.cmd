@@ -1,3 +1,2 @@
-export PSPKG_RELEASE=xpp-3.0.0
-. /reg/g/pcds/pkg_mgr/etc/set_env.sh
-python idler.py
+HERE=`dirname $(readlink -f $0)`
+"${HERE}/mfxrun" "${HERE}/idler.py" "$@"
@@ -4,6 +4,8 @@ Take a pedestal for the Jungfrau
 import time
 import socket
 import argparse
+import threading
+from contextlib import contextmanager
 
 from pydaq import Control
 from blbase.daq_config_device import Dcfg
@@ -22,6 +24,13 @@ class Jungfrau(Dcfg):
     Class for the Jungfrau. Provides a way to Jungfrau
     configurations from within a hutch python session.
     """
+    gainModes = {'FixedGain1': 1,
+                 'FixedGain2': 2,
+                 'ForcedGain1': 3,
+                 'ForcedGain2': 4,
+                 'HighGain0': 5,
+                 'Normal': 0}
+
     def __init__(self, hutch, src, *aliases):
         """
         Programatically sets up get_name and set_name methods during init.
@@ -32,16 +41,12 @@ class Jungfrau(Dcfg):
         self.src = src
         Dcfg.__init__(self, hutch, *aliases, src=src, typeid=0x3006b) 
         self._add_methods("gainMode", "gainMode")
-        self._jfGainMode = {'FixedGain1': 1,
-                           'FixedGain2': 2,
-                           'ForcedGain1': 3,
-                           'ForcedGain2': 4,
-                           'HighGain0': 5,
-                           'Normal': 0}
-
-    def gainName(self, gain=0):
-        for key in self._jfGainMode:
-            if self._jfGainMode[key]==gain:
+        self._jfGainMode = self.gainModes
+
+    @classmethod
+    def gainName(cls, gain=0):
+        for key in cls.gainModes:
+            if cls.gainModes[key]==gain:
                 return key
 
 
@@ -52,9 +57,125 @@ class Jungfrau(Dcfg):
         Dcfg.commit(self)
 
 
-def takeJungfrauPedestals(record=True, nEvts=1000):
+def switch_gainmodes(jfs, gainmode, timeout=60., max_delay=1.):
+    """
+    Switch a group of Jungfraus to the same gain mode at once
+
+    All of the detectors that need to change are committed in a single
+    pass, one after another as they share the configuration database alias,
+    so a failed commit raises straight away. The group is then polled with
+    an exponential backoff until every detector reports the new mode.
+
+    Parameters
+    ----------
+    jfs: list of Jungfrau
+
+    gainmode: int
+        Requested gain mode
+
+    timeout: float, optional
+        Time to wait for the whole group before giving up
+
+    max_delay: float, optional
+        Longest interval between two checks
+
+    Returns
+    -------
+    times: dict
+        Seconds each detector took to reach the mode, keyed by ``src``
+    """
+    start = time.time()
+    times = dict()
+    pending = list()
+    for jf in jfs:
+        if jf.get_gainmode() == gainmode:
+            times[jf.src] = 0.
+        else:
+            jf.set_gainmode(gainmode)
+            pending.append(jf)
+    # Commit the whole group before waiting on any of them
+    for jf in pending:
+        jf.commit()
+    delay = 0.05
+    while pending:
+        for jf in list(pending):
+            if jf.get_gainmode() == gainmode:
+                times[jf.src] = time.time() - start
+                pending.remove(jf)
+        if not pending:
+            break
+        if time.time() - start > timeout:
+            raise RuntimeError('Timed out switching {} to {}'.format(
+                               [jf.src for jf in pending],
+                               Jungfrau.gainName(gainmode)))
+        time.sleep(delay)
+        delay = min(2 * delay, max_delay)
+    return times
+
+
+class PhaseTimer(object):
+    """
+    Wall time of each phase of the pedestal runs
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, mode, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(mode, name, time.time() - start)
+
+    def record(self, mode, name, duration):
+        self.phases.append((mode, name, duration))
+
+    def report(self):
+        print '{:<12} {:<20} {:>8}'.format('Gain', 'Phase', 'Time (s)')
+        for mode, name, duration in self.phases:
+            print '{:<12} {:<20} {:>8.2f}'.format(mode, name, duration)
+        print 'Total calibration time {:.2f} s'.format(time.time() - self.start)
+
+
+class Background(threading.Thread):
+    """
+    Run a function in a thread and collect its result and duration
+    """
+    def __init__(self, func, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.value = None
+        self.error = None
+        self.duration = 0.
+        self.start()
+
+    def run(self):
+        start = time.time()
+        try:
+            self.value = self.func(*self.args)
+        except Exception as exc:
+            self.error = exc
+        self.duration = time.time() - start
+
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def takeJungfrauPedestals(record=True, nEvts=1000, pipeline=True):
     """
     Take Jungfrau Pedestals for all Jungfrau detectors.
+
+    With ``pipeline`` the gain switch for the next mode is written to the
+    configuration database while the previous run is being closed. The DAQ
+    has already read the configuration for that run, and the next configure
+    only happens once the switch has completed.
     """
     daq.connect()
 
@@ -68,35 +189,50 @@ def takeJungfrauPedestals(record=True, nEvts=1000):
     for jf in jfs:
         currMode=jf.get_gainmode()
         print 'current mode for {} : {}'.format(jf.src, jf.gainName(currMode))
+    modes = []
     for thisgainmode in gainmodes:
+        if isinstance(thisgainmode, basestring):
+            modes.append((Jungfrau.gainModes[thisgainmode], thisgainmode))
+        else:
+            modes.append((thisgainmode, Jungfrau.gainName(thisgainmode)))
+    # Return to Normal once we are done
+    final = (Jungfrau.gainModes['Normal'], 'Normal')
+
+    timer = PhaseTimer()
+    runs = []
+    print 'switching gainmode to ', modes[0][1]
+    with timer.phase(modes[0][1], 'switch'):
+        times = switch_gainmodes(jfs, modes[0][0])
+    for i, (thisgainmode, thisgainmode_string) in enumerate(modes):
         for jf in jfs:
-            print 'Collecting pedestal for {} with mode {}'.format(jf.src,  thisgainmode)
-            if isinstance(thisgainmode, basestring):
-                thisgainmode_string = thisgainmode
-                thisgainmode = jf._jfGainMode[thisgainmode]
-            else:
-                thisgainmode_string = jf.gainName(thisgainmode)
-            print 'switching gainmode to ',thisgainmode_string
-            if jf.get_gainmode()!= thisgainmode:
-                jf.set_gainmode(thisgainmode)
-                jf.commit()
-
-                if jf.get_gainmode() != thisgainmode:
-                    print 'waiting for gain to switch from ',jf.gainName(jf.get_gainmode()),' to ', thisgainmode_string
-                while jf.get_gainmode() != thisgainmode:
-                    time.sleep(0.5)
-
-        daq.configure(events=0, record=record)
+            print 'Collecting pedestal for {} with mode {}, switched in {:.2f} s'.format(jf.src, thisgainmode_string, times[jf.src])
+        with timer.phase(thisgainmode_string, 'configure'):
+            daq.configure(events=0, record=record)
         print 'take run for gain ',thisgainmode_string
-        daq.begin(events=nEvts)
-        daq.end()
-        daq.endrun()
-        print 'took run %d for gain %s with %d events'%(daq.runnumber(),thisgainmode_string, nEvts)
-
-    for jf in jfs:
-        jf.set_gainmode(0)
-        jf.commit()
-    print 'now call makepeds -J -r ',int(daq.runnumber())-2
+        with timer.phase(thisgainmode_string, 'run'):
+            daq.begin(events=nEvts)
+            daq.end()
+        nextgainmode, nextgainmode_string = (modes + [final])[i + 1]
+        if pipeline:
+            print 'switching gainmode to ', nextgainmode_string, 'during endrun'
+            prep = Background(switch_gainmodes, jfs, nextgainmode)
+        with timer.phase(thisgainmode_string, 'endrun'):
+            daq.endrun()
+        runs.append(int(daq.runnumber()))
+        print 'took run %d for gain %s with %d events'%(runs[-1],thisgainmode_string, nEvts)
+        if pipeline:
+            with timer.phase(nextgainmode_string, 'switch (wait)'):
+                times = prep.result()
+            timer.record(nextgainmode_string, 'switch (overlapped)',
+                         prep.duration)
+        else:
+            print 'switching gainmode to ', nextgainmode_string
+            with timer.phase(nextgainmode_string, 'switch'):
+                times = switch_gainmodes(jfs, nextgainmode)
+
+    timer.report()
+    print 'now call makepeds -J -r ', runs[0]
+    print 'or stream them with python -m mfx.pedestals runs <exp> <detector>', ' '.join(str(run) for run in runs)
     daq.disconnect()
 
 if __name__ == '__main__':
@@ -104,5 +240,8 @@ if __name__ == '__main__':
     parser.add_argument('nevents', type=int, help='Number of events')
     parser.add_argument('--record', action='store_true',
                         help='Option to record')
+    parser.add_argument('--serial', action='store_true',
+                        help='Do not switch gain modes during endrun')
     args = parser.parse_args()
-    takeJungfrauPedestals(record=args.record, nEvts=args.nevents)
+    takeJungfrauPedestals(record=args.record, nEvts=args.nevents,
+                          pipeline=not args.serial)
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+import subprocess
+
+import pytest
+
+from mfx.elog import ElogQueue
+
+
+class FakeElog:
+    """Records posts, failing the first ``failures`` attempts"""
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.posts = list()
+        self.attempts = list()
+
+    def post(self, msg, **kwargs):
+        self.attempts.append(time.perf_counter())
+        if self.gate is not None:
+            self.gate.wait()
+        if len(self.attempts) <= self.failures:
+            raise RuntimeError("ELog unavailable")
+        self.posts.append((msg, kwargs))
+
+
+class RecordingQueue(ElogQueue):
+    """Remembers the number of posts written to the spool each time"""
+    def __init__(self, *args, **kwargs):
+        self.spooled = list()
+        super().__init__(*args, **kwargs)
+
+    def _write_spool(self, items):
+        self.spooled.append(len(items))
+        super()._write_spool(items)
+
+
+def read_spool(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return str(tmp_path / 'spool' / 'elog.jsonl')
+
+
+def test_posts_in_order():
+    elog = FakeElog()
+    queue = ElogQueue(elog)
+    for i in range(25):
+        queue.post('msg {}'.format(i), runnum=i)
+    assert queue.flush(timeout=5)
+    assert elog.posts == [('msg {}'.format(i), {'runnum': i})
+                          for i in range(25)]
+    assert queue.sent == 25
+    assert queue.pending == 0
+    queue.stop()
+
+
+def test_post_does_not_wait_on_elog():
+    gate = threading.Event()
+    queue = ElogQueue(FakeElog(gate=gate))
+    start = time.perf_counter()
+    for i in range(10):
+        queue.post('msg {}'.format(i))
+    assert time.perf_counter() - start < 0.5
+    assert not queue.flush(timeout=0.1)
+    assert queue.pending == 10
+    gate.set()
+    assert queue.flush(timeout=5)
+    queue.stop()
+
+
+def test_batches_rewrite_spool(spool):
+    gate = threading.Event()
+    elog = FakeElog(gate=gate)
+    queue = RecordingQueue(elog, spool=spool, batch_size=3)
+    for i in range(10):
+        queue.post('msg {}'.format(i))
+    # Wait for the worker to take the first post before releasing it
+    while not elog.attempts:
+        time.sleep(0.01)
+    gate.set()
+    assert queue.flush(timeout=5)
+    assert len(elog.posts) == 10
+    # At most one batch is sent between rewrites of the spool. The first
+    # is written before the rest of the posts were queued
+    remaining = queue.spooled[1:]
+    assert remaining[-1] == 0
+    assert all(0 <= before - after <= 3
+               for before, after in zip(remaining, remaining[1:]))
+    assert read_spool(queue.spool) == []
+    queue.stop()
+
+
+def test_retry_with_backoff():
+    elog = FakeElog(failures=4)
+    queue = ElogQueue(elog, backoff=0.05, max_backoff=0.1)
+    queue.post('first')
+    queue.post('second')
+    assert queue.flush(timeout=5)
+    assert elog.posts == [('first', {}), ('second', {})]
+    assert queue.failures == 4
+    gaps = [after - before for before, after
+            in zip(elog.attempts, elog.attempts[1:])]
+    # Doubles after every failure up to the maximum, then resets
+    for gap, delay in zip(gaps, (0.05, 0.1, 0.1, 0.1)):
+        assert gap >= 0.9 * delay
+    assert gaps[-1] < 0.05
+    queue.stop()
+
+
+def test_stop_leaves_posts_in_spool(spool):
+    queue = ElogQueue(FakeElog(failures=100), spool=spool, backoff=10.)
+    queue.post('kept', runnum=1)
+    while not queue.failures:
+        time.sleep(0.01)
+    queue.stop()
+    assert [item['msg'] for item in read_spool(queue.spool)] == ['kept']
+
+
+def test_recover_spool_after_crash(spool):
+    # A session that dies with a post it could not send
+    code = '\n'.join([
+        'import os, time',
+        'from mfx.elog import ElogQueue',
+        'class Down:',
+        '    def post(self, msg, **kwargs):',
+        '        raise RuntimeError("ELog unavailable")',
+        'queue = ElogQueue(Down(), spool={!r}, backoff=10.)'.format(spool),
+        'queue.post("lost", runnum=7)',
+        'while not queue.failures:',
+        '    time.sleep(0.01)',
+        'print(queue.spool, flush=True)',
+        'os._exit(1)'])
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+                            [os.path.dirname(os.path.dirname(__file__))]
+                            + env.get('PYTHONPATH', '').split(os.pathsep))
+    result = subprocess.run([sys.executable, '-c', code], env=env,
+                            stdout=subprocess.PIPE, timeout=30)
+    assert result.returncode == 1
+    crashed = result.stdout.decode().strip()
+    assert [item['msg'] for item in read_spool(crashed)] == ['lost']
+    elog = FakeElog()
+    queue = ElogQueue(elog, spool=spool)
+    assert queue.flush(timeout=5)
+    assert elog.posts == [('lost', {'runnum': 7})]
+    assert not os.path.exists(crashed)
+    queue.stop()
+
+
+def test_running_session_spool_is_left_alone(spool):
+    os.makedirs(os.path.dirname(spool))
+    root, ext = os.path.splitext(spool)
+    other = '{}.{}{}'.format(root, 1, ext)
+    with open(other, 'w') as f:
+        f.write(json.dumps({'msg': 'theirs', 'kwargs': {}}) + '\n')
+    # Held as if by another running session
+    fd = os.open(other + '.lock', os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        elog = FakeElog()
+        queue = ElogQueue(elog, spool=spool)
+        assert queue.flush(timeout=5)
+        assert elog.posts == []
+        assert read_spool(other)[0]['msg'] == 'theirs'
+        queue.stop()
+    finally:
+        os.close(fd)
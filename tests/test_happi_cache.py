@@ -0,0 +1,133 @@
+import os
+import json
+
+import pytest
+
+from mfx.happi_cache import HappiCache
+
+BEAMLINES = ('MFX', 'XPP', 'CXI', 'MEC', 'TMO', None)
+
+
+def make_db(path, ndevices=5000):
+    """Write a synthetic happi database spread over several beamlines"""
+    db = dict()
+    for i in range(ndevices):
+        beamline = BEAMLINES[i % len(BEAMLINES)]
+        name = '{}_dev_{}'.format((beamline or 'none').lower(), i)
+        db[name] = {'_id': name, 'name': name, 'beamline': beamline,
+                    'prefix': 'PV:{}'.format(i), 'active': True,
+                    'device_class': 'ophyd.sim.SynAxis', 'args': [],
+                    'kwargs': {'name': '{{name}}'}, 'z': float(i)}
+    with open(path, 'w') as f:
+        json.dump(db, f)
+    return db
+
+
+def expected(db, beamline):
+    return {_id: entry for _id, entry in db.items()
+            if str(entry['beamline'] or 'NONE').upper() == beamline}
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'db.json')
+    return path, make_db(path)
+
+
+@pytest.fixture
+def cache(source, tmp_path):
+    return HappiCache(source=source[0], cache_dir=str(tmp_path / 'cache'))
+
+
+def test_split_by_beamline(source, cache):
+    path, db = source
+    assert not cache.is_valid()
+    for beamline in ('MFX', 'xpp', 'NONE'):
+        entries = expected(db, beamline.upper())
+        assert cache.load(beamline) == entries
+        assert cache.names(beamline) == sorted(entries)
+    assert cache.is_valid()
+    mfx = cache.path('MFX')
+    assert mfx != path
+    with open(mfx) as f:
+        assert json.load(f) == expected(db, 'MFX')
+    # Unknown beamlines are empty rather than read from the source
+    assert cache.load('FOO') == {}
+    assert cache.path('FOO') == path
+
+
+def test_load_by_name(source, cache):
+    _, db = source
+    names = ['mfx_dev_0', 'mfx_dev_6', 'xpp_dev_1']
+    assert cache.load('MFX', names=names) == {name: db[name]
+                                              for name in names[:2]}
+
+
+def test_stale_cache_is_rebuilt(source, cache):
+    path, db = source
+    cache.load('MFX')
+    db['mfx_dev_0']['prefix'] = 'NEW:PV'
+    del db['mfx_dev_6']
+    with open(path, 'w') as f:
+        json.dump(db, f)
+    assert not cache.is_valid()
+    assert cache.load('MFX') == expected(db, 'MFX')
+    assert cache.is_valid()
+
+
+def test_removed_beamline_is_dropped(source, cache):
+    path, db = source
+    cache.load('MFX')
+    db = {_id: entry for _id, entry in db.items()
+          if entry['beamline'] != 'MEC'}
+    with open(path, 'w') as f:
+        json.dump(db, f)
+    assert cache.load('MEC') == {}
+    assert not os.path.exists(os.path.join(cache.cache_dir, 'MEC.json'))
+
+
+def test_hash_catches_same_size_and_mtime(source, tmp_path):
+    path, db = source
+    cache = HappiCache(source=path, cache_dir=str(tmp_path / 'cache'),
+                       verify_hash=True)
+    cache.load('MFX')
+    stat = os.stat(path)
+    with open(path) as f:
+        text = f.read()
+    # Same length, different content and the original modification time
+    text = text.replace('PV:0"', 'XV:0"', 1)
+    with open(path, 'w') as f:
+        f.write(text)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert HappiCache(source=path, cache_dir=cache.cache_dir).is_valid()
+    assert not cache.is_valid()
+    assert cache.load('MFX')['mfx_dev_0']['prefix'] == 'XV:0'
+
+
+def test_corrupted_index_is_rebuilt(source, cache):
+    _, db = source
+    cache.load('MFX')
+    with open(cache.index_path, 'w') as f:
+        f.write('{"stamp": ')
+    assert not cache.is_valid()
+    assert cache.load('MFX') == expected(db, 'MFX')
+    assert cache.is_valid()
+
+
+def test_corrupted_beamline_falls_back(source, cache):
+    _, db = source
+    cache.load('MFX')
+    with open(cache.path('MFX'), 'w') as f:
+        f.write('{"mfx_dev_0": ')
+    assert cache.load('MFX') == expected(db, 'MFX')
+
+
+def test_unusable_cache_falls_back(source, tmp_path):
+    path, db = source
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    cache = HappiCache(source=path, cache_dir=str(blocker / 'cache'))
+    assert not cache.ensure()
+    assert cache.path('MFX') == path
+    assert cache.load('MFX') == expected(db, 'MFX')
+    assert cache.names('MFX') == sorted(expected(db, 'MFX'))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from mfx.lenses import LensIndex
+
+
+@pytest.fixture(scope='module')
+def index():
+    prefocus = {'6K70': (750., 365.), '7K50': (500., 365.),
+                '9K45': (333., 365.)}
+    lenses = [(radius, 398. + 0.1 * i) for i, radius in
+              enumerate((50., 62.5, 100., 125., 200., 250., 500., 750.,
+                         1000., 1500.))]
+    return LensIndex(prefocus, lenses, energies=(4., 25., 0.05),
+                     cache_dir=None)
+
+
+def test_lookup_matches_brute_force(index):
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        energy = rng.uniform(4., 25.)
+        focus_z = rng.uniform(399., 420.)
+        combo = index.lookup(focus_z, energy)
+        focus = index.focus(energy)
+        best = np.nanmin(np.abs(focus - focus_z))
+        assert abs(combo.focus - focus_z) == pytest.approx(best, abs=1e-9)
+
+
+def test_lookup_on_grid_energy(index):
+    combo = index.lookup(405., 10.)
+    focus = index.focus(10.)
+    assert abs(combo.focus - 405.) == pytest.approx(
+                                    np.nanmin(np.abs(focus - 405.)))
+
+
+@pytest.mark.parametrize('energy', [3.99, 25.01, 0., -1.])
+def test_lookup_outside_grid(index, energy):
+    with pytest.raises(ValueError):
+        index.lookup(405., energy)
+
+
+def test_lookup_grid_edges(index):
+    for energy in (4., 25.):
+        combo = index.lookup(405., energy)
+        focus = index.focus(energy)
+        assert abs(combo.focus - 405.) == pytest.approx(
+                                    np.nanmin(np.abs(focus - 405.)))
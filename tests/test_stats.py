@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from mfx.stats import RollingStats
+
+
+def windows(samples, size, fill):
+    """Window of ``size`` samples after each one, numpy reference"""
+    padded = np.concatenate([np.full(size, fill), samples])
+    for i in range(1, len(samples) + 1):
+        yield padded[i:i + size]
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 120])
+def test_matches_numpy(size):
+    rng = np.random.default_rng(size)
+    samples = rng.normal(3., 2., 5 * size + 11)
+    stats = RollingStats(size, fill=1.)
+    for value, window in zip(samples, windows(samples, size, 1.)):
+        stats.update(value)
+        assert stats.mean == pytest.approx(window.mean(), abs=1e-12)
+        assert stats.var == pytest.approx(window.var(), abs=1e-9)
+        assert stats.std == pytest.approx(window.std(), abs=1e-6)
+        assert stats.min == window.min()
+        assert stats.max == window.max()
+    assert stats.count == len(samples)
+
+
+def test_fill_expires():
+    stats = RollingStats(3, fill=-10.)
+    assert stats.min == -10.
+    for value in (1., 2., 3.):
+        stats.update(value)
+    assert stats.min == 1.
+    assert stats.max == 3.
+    assert stats.var == pytest.approx(np.var([1., 2., 3.]))
+
+
+def test_monotonic_extrema():
+    stats = RollingStats(4)
+    for value in range(10):
+        stats.update(value)
+        assert stats.max == value
+        assert stats.min == max(value - 3, 0)
+    for value in range(10, 0, -1):
+        stats.update(value)
+    assert stats.min == 1
+    assert stats.max == 4
+
+
+def test_ewma():
+    rng = np.random.default_rng(1)
+    samples = rng.normal(size=50)
+    stats = RollingStats(9, fill=2.)
+    assert stats.alpha == pytest.approx(0.2)
+    expected = 2.
+    for value in samples:
+        stats.update(value)
+        expected += 0.2 * (value - expected)
+        assert stats.ewma == pytest.approx(expected)
+    assert RollingStats(9, alpha=0.5).alpha == 0.5
+
+
+def test_no_drift_with_large_offset():
+    rng = np.random.default_rng(2)
+    size = 120
+    samples = 1e6 + rng.normal(size=20 * size + 17)
+    stats = RollingStats(size, fill=1e6)
+    for value in samples:
+        stats.update(value)
+    window = samples[-size:]
+    assert stats.mean == pytest.approx(window.mean(), rel=1e-12)
+    assert stats.var == pytest.approx(window.var(), rel=1e-6)
+
+
+def test_reduce():
+    stats = RollingStats(4)
+    for value in (1., 5., 3., 7.):
+        stats.update(value)
+    for reducer in RollingStats.reducers:
+        assert stats.reduce(reducer) == getattr(stats, reducer)
+    assert stats.reduce() == 4.
+    with pytest.raises(ValueError):
+        stats.reduce('median')
+
+
+def test_reset():
+    stats = RollingStats(3)
+    for value in (4., 5., 6.):
+        stats.update(value)
+    stats.reset(2.)
+    assert stats.mean == 2.
+    assert stats.var == 0.
+    assert stats.min == stats.max == 2.
+    assert stats.count == 0
+
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        RollingStats(0)
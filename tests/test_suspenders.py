@@ -0,0 +1,105 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+from ophyd.signal import Signal
+
+from mfx.averaging import AveragingService
+from mfx.suspenders import AvgSignal, BeamEnergySuspendFloor
+
+
+def averaged(averages=4, fill=0., **kwargs):
+    source = Signal(name='gdet', value=fill)
+    return source, AvgSignal(source, averages, name='gdet_avg', **kwargs)
+
+
+@pytest.mark.parametrize('reducer', ['mean', 'std', 'min', 'max', 'ewma'])
+def test_reducers(reducer):
+    source, avg = averaged(reducer=reducer)
+    for value in (1., 5., 3., 7., 2.):
+        source.put(value)
+    assert avg.get() == pytest.approx(avg.stats.reduce(reducer))
+    assert avg.raw_updates == avg.published_updates == 5
+
+
+def test_callable_reducer():
+    source, avg = averaged(reducer=lambda stats: stats.mean - 2 * stats.std)
+    for value in (1., 5., 3., 7.):
+        source.put(value)
+    values = np.array([1., 5., 3., 7.])
+    assert avg.get() == pytest.approx(values.mean() - 2 * values.std())
+
+
+def test_unknown_reducer():
+    with pytest.raises(ValueError):
+        averaged(reducer='median')
+
+
+def test_deadband():
+    source, avg = averaged(averages=1, deadband=0.5)
+    for value in (1., 1.2, 1.4, 1.6, 1.7, 0.9):
+        source.put(value)
+    assert avg.raw_updates == 6
+    assert avg.published_updates == 3
+    assert avg.get() == 0.9
+
+
+def test_rel_deadband():
+    source, avg = averaged(averages=1, fill=100., rel_deadband=0.1)
+    for value in (100., 105., 111., 115., 90.):
+        source.put(value)
+    # The first update always publishes
+    assert avg.published_updates == 3
+    assert avg.get() == 90.
+
+
+def test_max_rate_coalesces():
+    source, avg = averaged(averages=1, max_rate=10.)
+    for value in range(1, 51):
+        source.put(float(value))
+    assert avg.raw_updates == 50
+    assert avg.published_updates == 1
+    # Only the latest value is published once the interval has passed
+    time.sleep(0.3)
+    assert avg.published_updates == 2
+    assert avg.get() == 50.
+
+
+def test_service_rejects_options():
+    service = AveragingService()
+    for option in ({'reducer': 'std'}, {'deadband': 0.1},
+                   {'rel_deadband': 0.1}, {'max_rate': 1.}):
+        with pytest.raises(ValueError):
+            BeamEnergySuspendFloor(0.5, service=service, **option)
+    assert not service.views
+
+
+def test_process_lock():
+    service = AveragingService(capacity=2, max_window=10)
+    sources = [Signal(name='sig_{}'.format(i), value=0.) for i in range(2)]
+    views = [service.add(source, 10) for source in sources]
+    done = threading.Event()
+
+    def drain():
+        while not done.is_set():
+            service.process()
+
+    threads = [threading.Thread(target=drain) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    values = np.arange(5000, dtype=float)
+    for value in values:
+        for source in sources:
+            source.put(value)
+    done.set()
+    for thread in threads:
+        thread.join()
+    service.process()
+    # Samples are folded in the order they arrived, once each, and the last
+    # published average is the newest
+    for row, view in enumerate(views):
+        assert service.sums[row] == pytest.approx(values[-10:].sum())
+        assert sorted(view.values) == list(values[-10:])
+        assert view.get() == pytest.approx(values[-10:].mean())
+    service.stop()